@@ -1,5 +1,4 @@
 import random as rand
-from collections import Counter
 
 class Agent:
     """
@@ -14,8 +13,11 @@ class Agent:
     that can believe and/or share their opinion
     and can output their network information
     """
+    __slots__ = ('prob_prebunk', 'node_id', 'prob_share_opinion', 'prob_immunize', 'opinion', 'status', 'frequency',
+                 'resistance', 'dark', 'prebunk', 'rng', 'share_friends_opinion', 'friends', 'engagement',
+                 'engagement_opinion', 'next_opinion')
 
-    def __init__(self, prob_prebunk, node_id, prob_share_opinion, prob_immunize, opinion=0, status="S", frequency=1, resistance=False, dark=False, prebunk=False):
+    def __init__(self, prob_prebunk, node_id, prob_share_opinion, prob_immunize, opinion=0, status="S", frequency=1, resistance=False, dark=False, prebunk=False, rng=rand):
         """
         prob_prebunk: (float)
             probability of becoming immune against disinformation
@@ -41,6 +43,8 @@ class Agent:
         dark: (bool)
             True: is a 'dark agent' that can trigger disinformation campaigns
             [False]: not a dark agent
+        rng: (random.Random)
+            [random]: source of the random draws of the agent
         """
         self.prob_prebunk = prob_prebunk
         self.node_id = node_id
@@ -52,40 +56,51 @@ class Agent:
         self.resistance = resistance
         self.dark = dark
         self.prebunk = prebunk
+        self.rng = rng
 
         self.share_friends_opinion = .5 # probability to become a disinformation agent, based on friends opinion
         self.friends = []
-        self.opinion_history = []
-        self.engagement = []
+        self.engagement = 0  # how often the opinion was shared in this tick
+        self.engagement_opinion = opinion  # the opinion that was shared
         self.next_opinion = False
 
-    def share(self):
+    def share(self, u=None):
         """
         Defines the sharing behavior of nodes: Either has no opinion, shares disinformation, or fact checking information
+        u: (float)
+            [None]: uniform draw of the share decision (common random numbers), drawn from rng by default
         """
-        self.engagement = []
+        self.engagement = 0
 
-        if rand.random() <= self.prob_share_opinion:
-            self.engagement = [self.opinion for _ in range(self.frequency)]
+        if (self.rng.random() if u is None else u) <= self.prob_share_opinion:
+            self.engagement = self.frequency
+            self.engagement_opinion = self.opinion
 
-    def check_friends(self):
+    def check_friends(self, u_prebunk=None, u_immunize=None):
         """
         Based on the neighbouring nodes, the status of the node under consideration is updated
+        u_prebunk, u_immunize: (float)
+            [None]: uniform draws of the prebunk and immunize decisions (common random numbers), drawn from rng by
+            default
         """
         if self.resistance:
             self.next_opinion = self.opinion  # If resistant, nothing changes
             return
 
-        # Get all opinion from friends
-        all_opinions = []
+        # Count the shares of all friends per opinion
+        n_all = n_1 = n_2 = 0
         for friend in self.friends:
-            all_opinions.extend(friend.engagement)
-        count = Counter(all_opinions)
+            engagement = friend.engagement
+            if engagement:
+                n_all += engagement
+                if friend.engagement_opinion == 1:
+                    n_1 += engagement
+                elif friend.engagement_opinion == 2:
+                    n_2 += engagement
 
         # Handle disinformation logic (opinion 1)
-        n_1 = count.get(1)
         if n_1:
-            prob = n_1 / len(all_opinions)
+            prob = n_1 / n_all
             if prob > self.share_friends_opinion:
                 self.next_opinion = 1  # Disinformation
                 self.status = "I"  # Infected
@@ -93,14 +108,14 @@ class Agent:
                 return
 
         # Handle fact-checking logic (opinion 2)
-        n_2 = count.get(2)
         if n_2:
-            if rand.random() < self.prob_prebunk:  # Will an Agent be immunised?
+            if (self.rng.random() if u_prebunk is None else u_prebunk) < self.prob_prebunk:  # Will an Agent be immunised?
                 self.resistance = True
                 self.status = "R"
                 self.next_opinion = 0
 
-                if rand.random() < self.prob_immunize:  # Will an Agent be resistant AND shares prebunking content?
+                # Will an Agent be resistant AND shares prebunking content?
+                if (self.rng.random() if u_immunize is None else u_immunize) < self.prob_immunize:
                     self.next_opinion = 2
                     self.status = 'aR'
                 return
@@ -109,10 +124,10 @@ class Agent:
 
     def update_opinion(self, prob_share_indifferent, prob_share_disinfo, prob_share_facts):
         """
-        Records and changes the opinion of the node (from no opinion to either infected or resistant) and also the
-        probability to share opinion with its friends based on its opinion.
+        Changes the opinion of the node (from no opinion to either infected or resistant) and also the
+        probability to share opinion with its friends based on its opinion. The opinions are recorded by run_model
+        according to its history policy (see OpinionHistory).
         """
-        self.opinion_history.append(self.opinion)
         self.opinion = self.next_opinion
         if self.dark or self.prebunk:
             return
@@ -156,47 +171,13 @@ class Agent:
 
         return tie_list
 
-    def attack(self, tick, kind, start):
-        """
-        Executes an attack based on the given attack type (kind) and simulation step (tick), starting at given
-        simulation step (start).
-        """
-    #if self.dark:
-        match kind:
-            case 0: # Scenario 1: One single step with 50 times sharing
-                if tick == start:
-                    self.frequency = 50
-                    self.share()
-                    self.frequency = 1
-                    return
-                self.share()
-            case 1: # Scenario 2: With an increasing volume(10, 30, and 50 times) over three steps with a step of
-                    # normal sharing behavior in between the attack steps
-                if tick == start:
-                    self.frequency = 10
-                    self.share()
-                    self.frequency = 1
-                elif tick == start + 2:
-                    self.frequency = 30
-                    self.share()
-                    self.frequency = 1
-                elif tick == start + 4:
-                    self.frequency = 50
-                    self.share()
-                    self.frequency = 1
-                else:
-                    self.share()
-            case 2: # Scenario 3: Frequency decreases over 5 steps, each step 2 ticks long (50, 40 ,30, 20, 10) Times
-                frequency_values = [50, 50, 40, 40, 30, 30, 20, 20, 10, 10]
-                if start <= tick < len(frequency_values) + start:
-                    actual_value = frequency_values[tick - start]
-                    self.frequency = actual_value
-                else:
-                    self.frequency = 1
-
-                self.share()
-            case _: # Default behaviour
-                self.share()
+    def attack(self, frequency, u=None):
+        """
+        Shares as a dark agent with the frequency of the attack at the current tick, looked up from the attack schedule
+        of the run (see attacks.attack_schedule), u is passed on to share.
+        """
+        self.frequency = frequency
+        self.share(u)
 
     def alter_agent(self, kind):
         """
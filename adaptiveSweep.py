@@ -0,0 +1,211 @@
+import itertools
+
+import numpy as np
+from runSweep import sweep_cell, sweep_attrs, run_sweep, SWEEP_AXES
+from resultCache import ResultCache
+from resultStore import ResultStore, cell_metrics, store_metrics, json_attrs
+
+
+def grid_values(resolution):
+    """
+    Values of every probability axis for the given step, e.g. 0.05 -> 0.0, 0.05, ..., 1.0
+    """
+    return [round(float(value), 6) for value in np.arange(0, 1 + resolution / 2, resolution)]
+
+
+def design_points(n_points, n_values, design='lhs', rng=None):
+    """
+    Space-filling start design over the five probabilities, snapped to the grid
+    n_points: (int)
+        number of points of the design
+    n_values: (int)
+        number of grid values per axis
+    design: (str)
+        ['lhs']: Latin hypercube, 'sobol': scrambled Sobol sequence (needs scipy)
+    returns the grid indices of the unique design points (n, 5)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    dims = len(SWEEP_AXES)
+
+    if design == 'lhs':
+        # One point per stratum on every axis, strata are matched randomly between the axes
+        strata = np.array([rng.permutation(n_points) for _ in range(dims)]).T
+        unit = (strata + rng.random((n_points, dims))) / n_points
+    elif design == 'sobol':
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("The 'sobol' design needs scipy, use design='lhs' without it.") from None
+        unit = qmc.Sobol(dims, seed=rng).random(n_points)
+    else:
+        raise ValueError(f"Unknown design: {design}")
+
+    return np.unique(np.rint(unit * (n_values - 1)).astype(int), axis=0)
+
+
+def nearest_neighbours(points, k):
+    """
+    Indices of the k nearest other points of every grid point. The grid is cut into cubes and a point is only compared
+    with the points of its own and the adjacent cubes, which is exact as soon as its k-th neighbour is closer than any
+    point outside of these cubes can be. Cubes start with a side of one grid step, the side is doubled for the points
+    that are not exact yet, so points in dense regions (e.g. refined around a threshold) never meet far away points.
+    points: (np.ndarray)
+        grid indices (n, dims)
+    returns the neighbour indices (n, k), nearest first
+    """
+    n, dims = points.shape
+    offsets = np.array(list(itertools.product((-1, 0, 1), repeat=dims)))
+    neighbours = np.zeros((n, k), dtype=np.int64)
+    pending = np.arange(n)
+    side = 1
+    top = points.max(axis=0)
+    while len(pending):
+        # Cube of every point as one integer code, shifted by one so that adjacent cubes have no negative index
+        cubes = points // side + 1
+        place = (int(cubes.max()) + 2) ** np.arange(dims)
+        codes = cubes @ place
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+
+        unresolved = []
+        for start in range(0, len(pending), 512):
+            rows = pending[start:start + 512]
+            adjacent = (codes[rows, None] + offsets @ place).ravel()
+            low = np.searchsorted(sorted_codes, adjacent, 'left')
+            lengths = np.searchsorted(sorted_codes, adjacent, 'right') - low
+            counts = lengths.reshape(len(rows), -1).sum(axis=1)
+
+            # Candidate pairs (row, point) sorted by row and distance, the point itself last
+            pair_rows = np.repeat(np.arange(len(rows)), counts)
+            candidates = order[np.repeat(low - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+            distances = ((points[rows[pair_rows]] - points[candidates]) ** 2).sum(axis=1)
+            distances[candidates == rows[pair_rows]] = np.iinfo(distances.dtype).max
+            pairs = np.lexsort((distances, pair_rows))
+            first = np.cumsum(counts) - counts
+
+            enough = counts > k
+            nearest = first[enough, None] + np.arange(k)
+            neighbours[rows[enough]] = candidates[pairs[nearest]]
+            exact = distances[pairs[nearest[:, -1]]] <= outside_distance(points[rows[enough]], side, top) ** 2
+            unresolved.append(rows[~enough])
+            unresolved.append(rows[enough][~exact])
+        pending = np.concatenate(unresolved)
+        side *= 2
+    return neighbours
+
+
+def outside_distance(points, side, top):
+    """
+    Smallest distance of the given grid points to a grid point outside of their own and the adjacent cubes (infinite
+    if these cubes cover the whole grid up to top, the largest index on every axis)
+    """
+    start = (points // side - 1) * side
+    end = (points // side + 2) * side - 1
+    below = np.where(start > 0, points - start + 1, np.inf)
+    above = np.where(end < top, end + 1 - points, np.inf)
+    return np.minimum(below, above).min(axis=1)
+
+
+def refine(evaluated, threshold, n_neighbours=10):
+    """
+    Refinement candidates: for every evaluated point and each of its nearest evaluated neighbours, the grid midpoint
+    of the pair if the outcome (final infected and resistant proportion) differs by more than threshold between them
+    evaluated: (dict)
+        grid index tuple of every evaluated point mapped to its outcome (proportion infected, proportion resistant)
+    returns the candidate grid indices, sharpest changes first
+    """
+    points = np.array(list(evaluated))
+    outcomes = np.array(list(evaluated.values()))
+    k = min(n_neighbours, len(points) - 1)
+    if k < 1:
+        return []
+
+    candidates = {}
+    for i, row in enumerate(nearest_neighbours(points, k)):
+        change = np.abs(outcomes[row] - outcomes[i]).max(axis=1)
+        for j in row[change > threshold]:
+            midpoint = tuple((points[i] + points[j]) // 2)
+            if midpoint not in evaluated:
+                candidates[midpoint] = max(candidates.get(midpoint, 0), np.abs(outcomes[j] - outcomes[i]).max())
+
+    return sorted(candidates, key=candidates.get, reverse=True)
+
+
+def explore(store, budget, attack_kind, attack_start, root_seed, n_initial=256, batch_cells=64, threshold=.1,
+            design='lhs', n_workers=None, cache=None, **cell_params):
+    """
+    Adaptive exploration of the five probabilities: a space-filling start design on the grid of the store, then
+    rounds of refinement at the midpoints between neighbouring points with sharply different outcomes (e.g. at the
+    epidemic threshold), until the budget is spent or no pair can be refined further
+    store: (resultStore.ResultStore)
+        store the cells are written into, its axes define the grid
+    budget: (int)
+        total number of simulations (replicates over all cells, including the cells already in the store)
+    n_initial: (int)
+        [256]: number of points of the start design
+    batch_cells: (int)
+        [64]: number of cells run in one refinement round
+    threshold: (float)
+        [0.1]: change of the infected or resistant proportion between neighbours that triggers refinement
+    design: (str)
+        ['lhs']: start design, see design_points
+    cell_params: passed on to sweep_cell (n_reps, pop_size, graph_bank, adaptive, ...)
+    returns the number of simulations spent on all cells of the store
+    """
+    values = [store.axes[axis] for axis in SWEEP_AXES]
+    reference = sweep_cell({axis: float(values[d][0]) for d, axis in enumerate(SWEEP_AXES)}, attack_kind, attack_start,
+                           root_seed, **cell_params)
+    if json_attrs(sweep_attrs(reference)) != store.attrs:
+        raise ValueError(f"Store at {store.path} was created for a different sweep.")
+    n_values = len(values[0])
+    n_reps = cell_params.get('n_reps', 100)
+    pop_size = cell_params.get('pop_size', 100)
+
+    evaluated = {idx: tuple(np.array([store.data['i'][idx], store.data['r'][idx]]) / pop_size)
+                 for idx, _ in store.cells()}
+    queue = [tuple(point) for point in design_points(n_initial, n_values, design, np.random.default_rng(root_seed))
+             if tuple(point) not in evaluated]
+    # Simulations of the cells already in the store count towards the budget (the achieved replicates of adaptive cells)
+    done = store.done
+    spent = int(np.asarray(store.data['n_reps'])[done].sum()) if 'n_reps' in store.data else n_reps * int(done.sum())
+
+    while True:
+        if not queue:
+            queue = refine(evaluated, threshold)
+        batch = queue[:max(0, min(batch_cells, (budget - spent) // n_reps))]
+        if not batch:
+            break
+        queue = queue[len(batch):]
+
+        cells = [sweep_cell({axis: float(values[d][idx[d]]) for d, axis in enumerate(SWEEP_AXES)},
+                            attack_kind, attack_start, root_seed, **cell_params) for idx in batch]
+        for idx, (cell, result) in zip(batch, run_sweep(cells, n_workers=n_workers, cache=cache)):
+            end_result = result[0]
+            store.write(cell, cell_metrics(*result))
+            evaluated[idx] = (end_result['n_i'] / pop_size, end_result['n_r'] / pop_size)
+            spent += end_result.get('n_reps', n_reps)
+        store.flush()
+
+    return spent
+
+
+if __name__ == '__main__':
+    attack_kind = 0
+    root_seed = 311
+    attack_start = 5
+    n_ticks = 100
+    resolution = .05  # grid step of the five probabilities
+    budget = 500000  # total number of simulations
+    adaptive = dict(target_width=2.0)  # adaptive replicate count per cell, None for fixed 100 replicates
+    quantiles = ()  # e.g. (0.05, 0.95): bands over the replicates stored next to the means and standard deviations
+    store_path = f'results/explore_atk{attack_kind}'
+
+    axes = {axis: grid_values(resolution) for axis in SWEEP_AXES}
+    cell_params = dict(n_ticks=n_ticks, adaptive=adaptive, quantiles=quantiles)
+    reference = sweep_cell({axis: 0. for axis in SWEEP_AXES}, attack_kind, attack_start, root_seed, **cell_params)
+    store = ResultStore.open_or_create(store_path, axes, n_ticks, attrs=sweep_attrs(reference),
+                                       **store_metrics(adaptive is not None, quantiles), sparse=True)
+
+    spent = explore(store, budget, attack_kind, attack_start, root_seed, cache=ResultCache('cache'), **cell_params)
+    print('Explored', int(store.done.sum()), 'cells with', spent, 'simulations.')
@@ -0,0 +1,370 @@
+import numpy as np
+from attacks import attack_schedule
+from commonRandom import SHARE, PREBUNK, IMMUNIZE
+
+# Status codes of the array engine, the index is the code stored in ArrayPopulation.status
+STATUS_CODES = ("S", "I", "R", "aR", "uI")
+S, I, R, AR, UI = range(len(STATUS_CODES))
+
+
+class ArrayPopulation:
+    """
+    Array representation of one or more populations of agents. Every agent attribute that changes during a run is
+    kept as a flat array over all agents, the friendships are kept as CSR adjacency:
+    opinion        (int8) 0, 1 or 2 (no opinion, disinformation, fact-checkers)
+    status         (int8) index into STATUS_CODES
+    resistance     (bool) is the node able to change its opinion?
+    prob_share     (float) probability to share the opinion
+    frequency      (int) how much is shared per share call
+    dark, prebunk  (bool) dark agent and light (prebunking) agent flags
+    indptr, indices (int) CSR adjacency, the friends of agent a are indices[indptr[a]:indptr[a + 1]]
+
+    Several populations (replicates) of the same size can be stacked into one ArrayPopulation, their graphs are then
+    the blocks of one block-diagonal adjacency and agent a of replicate r is stored at r * pop_size + a.
+    """
+
+    def __init__(self, opinion, status, resistance, prob_share, frequency, dark, prebunk, prob_prebunk, prob_immunize,
+                 indptr, indices, n_reps=1, share_friends_opinion=.5):
+        self.opinion = opinion
+        self.status = status
+        self.resistance = resistance
+        self.prob_share = prob_share
+        self.frequency = frequency
+        self.dark = dark
+        self.prebunk = prebunk
+        self.prob_prebunk = prob_prebunk
+        self.prob_immunize = prob_immunize
+        self.indptr = indptr
+        self.indices = indices
+        self.n_reps = n_reps
+        self.share_friends_opinion = share_friends_opinion
+
+        self.n_agents = len(opinion)
+        self.pop_size = self.n_agents // n_reps
+        self.engagement = np.zeros(self.n_agents, dtype=np.int64)
+        # Row of every edge, i.e. the agent that reads the engagement of the friend in indices
+        self.rows = np.repeat(np.arange(self.n_agents), np.diff(indptr))
+        # Replicate of every agent, used to count per replicate
+        self.replicate = np.repeat(np.arange(n_reps), self.pop_size)
+        # Position of every agent in the population this one was created from (see subset)
+        self.agent_ids = np.arange(self.n_agents)
+
+    @classmethod
+    def from_populations(cls, populations):
+        """
+        Stack a list of Agent populations of equal size into one ArrayPopulation
+        """
+        agents = [agent for population in populations for agent in population]
+        offsets = np.repeat(np.arange(len(populations)) * len(populations[0]), len(populations[0]))
+
+        indptr = np.zeros(len(agents) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(agent.friends) for agent in agents])
+        indices = np.fromiter((friend.node_id for agent in agents for friend in agent.friends),
+                              dtype=np.int64, count=indptr[-1])
+        indices += np.repeat(offsets, np.diff(indptr))
+
+        return cls(
+            opinion=np.array([agent.opinion for agent in agents], dtype=np.int8),
+            status=np.array([STATUS_CODES.index(agent.status) for agent in agents], dtype=np.int8),
+            resistance=np.array([agent.resistance for agent in agents], dtype=bool),
+            prob_share=np.array([agent.prob_share_opinion for agent in agents], dtype=float),
+            frequency=np.array([agent.frequency for agent in agents], dtype=np.int64),
+            dark=np.array([agent.dark for agent in agents], dtype=bool),
+            prebunk=np.array([agent.prebunk for agent in agents], dtype=bool),
+            prob_prebunk=np.array([agent.prob_prebunk for agent in agents], dtype=float),
+            prob_immunize=np.array([agent.prob_immunize for agent in agents], dtype=float),
+            indptr=indptr,
+            indices=indices,
+            n_reps=len(populations),
+            share_friends_opinion=agents[0].share_friends_opinion,
+        )
+
+    @classmethod
+    def from_graphs(cls, graphs, prob_share_indifferent, prob_prebunk, prob_immunize):
+        """
+        Create the initial state of one replicate per friend graph without creating Agent objects, the state is the
+        same as the one of create_population on that graph
+        graphs: (list)
+            (indptr, indices, light, dark) of every replicate (light and dark are the ids of the light and dark agents),
+            all graphs have the same number of agents
+        """
+        pop_size = len(graphs[0][0]) - 1
+        n_agents = pop_size * len(graphs)
+        offsets = np.arange(len(graphs)) * pop_size
+
+        indptr = np.zeros(n_agents + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.concatenate([np.diff(graph[0]) for graph in graphs]))
+        indices = np.concatenate([graph[1].astype(np.int64) + offset for graph, offset in zip(graphs, offsets)])
+        light = np.concatenate([np.atleast_1d(graph[2]) + offset for graph, offset in zip(graphs, offsets)])
+        dark = np.concatenate([np.atleast_1d(graph[3]) + offset for graph, offset in zip(graphs, offsets)])
+
+        pop = cls(
+            opinion=np.zeros(n_agents, dtype=np.int8),
+            status=np.full(n_agents, S, dtype=np.int8),
+            resistance=np.zeros(n_agents, dtype=bool),
+            prob_share=np.full(n_agents, prob_share_indifferent, dtype=float),
+            frequency=np.ones(n_agents, dtype=np.int64),
+            dark=np.zeros(n_agents, dtype=bool),
+            prebunk=np.zeros(n_agents, dtype=bool),
+            prob_prebunk=np.full(n_agents, prob_prebunk, dtype=float),
+            prob_immunize=np.full(n_agents, prob_immunize, dtype=float),
+            indptr=indptr,
+            indices=indices,
+            n_reps=len(graphs),
+        )
+
+        # Same order as create_population: the light agents are altered first, the dark agents afterwards
+        pop.opinion[light], pop.status[light], pop.prebunk[light] = 2, AR, True
+        pop.opinion[dark], pop.status[dark], pop.dark[dark] = 1, UI, True
+        special = np.concatenate([light, dark])
+        pop.prob_share[special] = 1
+        pop.resistance[special] = True
+
+        return pop
+
+    def subset(self, replicates):
+        """
+        New ArrayPopulation holding only the selected replicates (boolean mask over the replicates), agent_ids of the
+        new population are the positions of its agents in this population
+        """
+        agents = replicates[self.replicate]
+        new_id = np.cumsum(agents) - 1
+        edges = agents[self.rows]
+
+        indptr = np.zeros(agents.sum() + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.diff(self.indptr)[agents])
+
+        pop = ArrayPopulation(
+            opinion=self.opinion[agents],
+            status=self.status[agents],
+            resistance=self.resistance[agents],
+            prob_share=self.prob_share[agents],
+            frequency=self.frequency[agents],
+            dark=self.dark[agents],
+            prebunk=self.prebunk[agents],
+            prob_prebunk=self.prob_prebunk[agents],
+            prob_immunize=self.prob_immunize[agents],
+            indptr=indptr,
+            indices=new_id[self.indices[edges]],
+            n_reps=int(replicates.sum()),
+            share_friends_opinion=self.share_friends_opinion,
+        )
+        pop.engagement = self.engagement[agents]
+        pop.agent_ids = self.agent_ids[agents]
+        return pop
+
+    def write_back(self, populations):
+        """
+        Copy the state of the arrays back onto the Agent objects it was created from (e.g. for drawing)
+        """
+        agents = [agent for population in populations for agent in population]
+        for i, agent in enumerate(agents):
+            agent.opinion = int(self.opinion[i])
+            agent.status = STATUS_CODES[self.status[i]]
+            agent.resistance = bool(self.resistance[i])
+            agent.prob_share_opinion = float(self.prob_share[i])
+
+
+def count(pop):
+    """
+    Vectorized get_opinion_shares_and_agent_proportion: returns the shares per opinion (n_reps, 3) and the number of
+    agents per status (n_reps, 5) and clears the engagement
+    """
+    shares = np.bincount(pop.replicate * 3 + pop.opinion, weights=pop.engagement, minlength=pop.n_reps * 3)
+    status = np.bincount(pop.replicate * len(STATUS_CODES) + pop.status, minlength=pop.n_reps * len(STATUS_CODES))
+    pop.engagement[:] = 0
+    return shares.reshape(pop.n_reps, 3).astype(np.int64), status.reshape(pop.n_reps, len(STATUS_CODES))
+
+
+def share(pop, rng, frequency, u=None):
+    """
+    Vectorized Agent.share / Agent.attack: every agent shares its opinion 'frequency' times with prob_share, the dark
+    agents with the attack frequency of the tick, u are the uniforms of the share decisions (common random numbers),
+    drawn from rng by default
+    """
+    pop.frequency[pop.dark] = frequency
+    if u is None:
+        u = rng.random(pop.n_agents)
+    pop.engagement = np.where(u <= pop.prob_share, pop.frequency, 0)
+
+
+def check_friends(pop, rng, u_prebunk=None, u_immunize=None):
+    """
+    Vectorized Agent.check_friends: returns the next opinion of every agent and updates status and resistance,
+    u_prebunk and u_immunize are the uniforms of the two decisions (common random numbers), drawn from rng by default
+    """
+    friend_engagement = pop.engagement[pop.indices]
+    friend_opinion = pop.opinion[pop.indices]
+    n_all = np.bincount(pop.rows, weights=friend_engagement, minlength=pop.n_agents)
+    n_1 = np.bincount(pop.rows, weights=friend_engagement * (friend_opinion == 1), minlength=pop.n_agents)
+    n_2 = np.bincount(pop.rows, weights=friend_engagement * (friend_opinion == 2), minlength=pop.n_agents)
+
+    susceptible = ~pop.resistance
+    prob = np.divide(n_1, n_all, out=np.zeros(pop.n_agents), where=n_all > 0)
+    infected = susceptible & (n_1 > 0) & (prob > pop.share_friends_opinion)
+
+    # The two draws of check_friends are only evaluated for agents that were exposed to fact checking
+    exposed = susceptible & ~infected & (n_2 > 0)
+    if u_prebunk is None:
+        u_prebunk = rng.random(pop.n_agents)
+    if u_immunize is None:
+        u_immunize = rng.random(pop.n_agents)
+    resistant = exposed & (u_prebunk < pop.prob_prebunk)
+    active = resistant & (u_immunize < pop.prob_immunize)
+
+    next_opinion = pop.opinion.copy()
+    next_opinion[infected] = 1
+    next_opinion[resistant] = 0
+    next_opinion[active] = 2
+
+    pop.status[infected] = I
+    pop.status[resistant] = R
+    pop.status[active] = AR
+    pop.resistance |= infected | resistant
+
+    return next_opinion
+
+
+def update_opinion(pop, next_opinion, prob_share_indifferent, prob_share_disinfo, prob_share_facts):
+    """
+    Vectorized Agent.update_opinion: sets the opinion and the sharing probability that belongs to it
+    """
+    pop.opinion = next_opinion
+    regular = ~(pop.dark | pop.prebunk)
+    prob_by_opinion = np.array([prob_share_indifferent, prob_share_disinfo, prob_share_facts])
+    pop.prob_share[regular] = prob_by_opinion[pop.opinion[regular]]
+
+
+def is_absorbing(pop):
+    """
+    Per replicate: can no agent change its status anymore? This is the case when no susceptible agent has a friend
+    that may share disinformation, or fact checking while the agent can still be immunized (e.g. when every regular
+    agent is resistant)
+    """
+    susceptible_edges = ~pop.resistance[pop.rows]
+    rows = pop.rows[susceptible_edges]
+    friends = pop.indices[susceptible_edges]
+    friend_opinion = pop.opinion[friends]
+    exposing = (pop.prob_share[friends] > 0) & (
+            (friend_opinion == 1) | ((friend_opinion == 2) & (pop.prob_prebunk[rows] > 0)))
+    return np.bincount(pop.replicate[rows[exposing]], minlength=pop.n_reps) == 0
+
+
+def fast_forward(pop, rng, shares, status, tick, schedule):
+    """
+    Fill the rest of the shares and status series of an absorbing population, the counts of tick are already set:
+    the status counts stay constant and the shares of the remaining ticks are drawn in bulk, as binomial counts per
+    group of agents with the same replicate, opinion and sharing probability (times the attack frequency of the
+    schedule, see attacks.attack_schedule, for dark agents)
+    """
+    n_ticks = shares.shape[1]
+    status[:, tick + 1:] = status[:, tick, None]
+    if tick + 1 >= n_ticks:
+        return
+
+    # Shares counted at tick t + 1 are shared at tick t
+    share_ticks = np.arange(tick, n_ticks - 1)
+    dark_frequency = schedule[share_ticks]
+
+    groups, n_agents = np.unique(np.stack([pop.replicate, pop.opinion, pop.dark, pop.prob_share]), axis=1,
+                                 return_counts=True)
+    replicate, opinion, dark, prob_share = groups
+    draws = rng.binomial(n_agents[:, None], prob_share[:, None], size=(len(n_agents), len(share_ticks)))
+    draws = np.where(dark[:, None] == 1, draws * dark_frequency, draws)
+    np.add.at(shares, (replicate.astype(int)[:, None], share_ticks + 1, opinion.astype(int)[:, None]), draws)
+
+
+def iter_simulate(pop, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts, attack_start,
+                  attack_kind, rng, history=None, fast_forward_absorbing=False, profiler=None, common=None):
+    """
+    Run the model on an ArrayPopulation tick by tick, same parameters as simulate
+    yields (tick, shares per opinion (n_reps, 3), number of agents per status (n_reps, 5)) counted at the start of
+    every tick, the next tick is only stepped when the next record is requested. Fast-forwarded replicates keep
+    yielding their fast-forwarded counts.
+    """
+    schedule = attack_schedule(attack_kind, attack_start, n_ticks)
+    shares = np.zeros((pop.n_reps, 3), dtype=np.int64)
+    status = np.zeros((pop.n_reps, len(STATUS_CODES)), dtype=np.int64)
+    active = np.arange(pop.n_reps)  # replicates that are still simulated
+    # Replicates taken out by fast_forward and their series from the tick they were taken out
+    done = np.zeros(0, dtype=np.int64)
+    done_shares = np.zeros((0, n_ticks, 3), dtype=np.int64)
+    done_status = np.zeros((0, n_ticks, len(STATUS_CODES)), dtype=np.int64)
+    if history is not None:
+        opinions = pop.opinion.copy()
+        history.start(opinions)
+
+    for tick in range(n_ticks):
+        shares[done], status[done] = done_shares[:, tick], done_status[:, tick]
+        if pop is None:
+            yield tick, shares.copy(), status.copy()
+            continue
+
+        shares[active], status[active] = count(pop)
+        if profiler is not None:
+            profiler.lap('count', agents=pop.opinion.size)
+
+        if fast_forward_absorbing:
+            absorbing = is_absorbing(pop)
+            if absorbing.any():
+                taken = pop.subset(absorbing) if not absorbing.all() else pop
+                taken_ids = active[absorbing]
+                taken_shares = np.zeros((len(taken_ids), n_ticks, 3), dtype=np.int64)
+                taken_status = np.zeros((len(taken_ids), n_ticks, len(STATUS_CODES)), dtype=np.int64)
+                taken_shares[:, tick], taken_status[:, tick] = shares[taken_ids], status[taken_ids]
+                fast_forward(taken, rng, taken_shares, taken_status, tick, schedule)
+                done = np.concatenate([done, taken_ids])
+                done_shares = np.concatenate([done_shares, taken_shares])
+                done_status = np.concatenate([done_status, taken_status])
+                if absorbing.all():
+                    pop = None
+                else:
+                    pop = pop.subset(~absorbing)
+                    active = active[~absorbing]
+                if profiler is not None:
+                    profiler.lap('fast_forward', agents=taken.opinion.size)
+                if pop is None:
+                    if history is not None:
+                        history.record_constant(tick, n_ticks - 1, opinions)
+                    yield tick, shares.copy(), status.copy()
+                    continue
+
+        yield tick, shares.copy(), status.copy()
+
+        uniforms = common.draw(active) if common is not None else (None, None, None)
+        share(pop, rng, schedule[tick], uniforms[SHARE])
+        if profiler is not None:
+            profiler.lap('share', agents=pop.opinion.size)
+            profiler.add('share', engagement=pop.engagement.sum())
+        next_opinion = check_friends(pop, rng, uniforms[PREBUNK], uniforms[IMMUNIZE])
+        if profiler is not None:
+            profiler.lap('check_friends', agents=pop.opinion.size)
+            profiler.add('update_opinion', transitions=np.count_nonzero(next_opinion != pop.opinion))
+        update_opinion(pop, next_opinion, prob_share_indifferent, prob_share_disinfo, prob_share_facts)
+        if profiler is not None:
+            profiler.lap('update_opinion', agents=pop.opinion.size)
+        if history is not None:
+            opinions[pop.agent_ids] = pop.opinion
+            history.record(tick, opinions)
+            if profiler is not None:
+                profiler.lap('history')
+
+
+def simulate(pop, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts, attack_start, attack_kind,
+             rng, history=None, fast_forward_absorbing=False, profiler=None, common=None):
+    """
+    Run the model on an ArrayPopulation for n_ticks, rng is a numpy Generator, history an optional OpinionHistory
+    (agent ids are the positions in the stacked population), profiler an optional PhaseProfiler and common an optional
+    commonRandom.CommonRandom over the replicates of pop that the share, prebunk and immunize decisions are drawn from.
+    With fast_forward_absorbing every replicate is taken out of the simulation as soon as it is absorbing and the rest
+    of its series is filled by fast_forward. pop then keeps the state of the moment the first replicates were taken
+    out, the history keeps the opinions of taken out replicates from the tick they were taken out on.
+    returns the shares per opinion (n_reps, n_ticks, 3) and the number of agents per status (n_reps, n_ticks, 5)
+    """
+    shares = np.zeros((pop.n_reps, n_ticks, 3), dtype=np.int64)
+    status = np.zeros((pop.n_reps, n_ticks, len(STATUS_CODES)), dtype=np.int64)
+    for tick, tick_shares, tick_status in iter_simulate(pop, n_ticks, prob_share_indifferent, prob_share_disinfo,
+                                                        prob_share_facts, attack_start, attack_kind, rng, history,
+                                                        fast_forward_absorbing, profiler, common):
+        shares[:, tick], status[:, tick] = tick_shares, tick_status
+    return shares, status
@@ -0,0 +1,31 @@
+import numpy as np
+
+# Attack scenarios of the dark agents as frequency schedules: how often a dark agent shares per share call at the ticks
+# from the attack start on. Outside its schedule (and for kinds without a schedule) a dark agent shares once per tick.
+ATTACK_SCHEDULES = {
+    # Scenario 1: one single step with 50 times sharing
+    0: (50,),
+    # Scenario 2: with an increasing volume (10, 30 and 50 times) over three steps with a step of normal sharing
+    # behaviour in between the attack steps
+    1: (10, 1, 30, 1, 50),
+    # Scenario 3: frequency decreases over 5 steps, each step 2 ticks long (50, 40, 30, 20, 10 times)
+    2: (50, 50, 40, 40, 30, 30, 20, 20, 10, 10),
+}
+
+
+def attack_schedule(kind, start, n_ticks):
+    """
+    Frequency of the share call of every dark agent at every tick of a run, compiled once per run so the engines only
+    look up the frequency of the current tick
+    kind: (int)
+        attack scenario, a key of ATTACK_SCHEDULES, every other kind is the default behaviour (sharing once)
+    start: (int)
+        tick the attack starts at
+    returns an (n_ticks,) int64 array
+    """
+    frequency = np.ones(n_ticks, dtype=np.int64)
+    values = np.asarray(ATTACK_SCHEDULES.get(kind, ()), dtype=np.int64)
+    ticks = np.arange(start, start + len(values))
+    inside = (ticks >= 0) & (ticks < n_ticks)
+    frequency[ticks[inside]] = values[inside]
+    return frequency
@@ -0,0 +1,299 @@
+import argparse
+import json
+import platform
+import random as rand
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import arrayModel
+from attacks import attack_schedule
+from friendGraph import friend_graph
+from runModel import create_population, get_opinion_shares_and_agent_proportion, run_model
+from runSweep import sweep_cell, run_cell, SWEEP_AXES
+from resultCache import code_version
+
+# Parameters of all benchmarks that do not vary them, a mid-range cell of the sweep
+PARAMS = dict(prob_share_indifferent=.5, prob_share_disinfo=.5, prob_share_facts=.5, prob_prebunk=.5, prob_immune=.5,
+              dark_quantile=.75, attack_start=5)
+
+
+def bench_create_population(pop_size, n_friends, n_add):
+    def setup(rng):
+        return lambda: create_population(False, pop_size, PARAMS['prob_share_indifferent'], PARAMS['prob_prebunk'],
+                                         PARAMS['prob_immune'], n_friends, n_add, PARAMS['dark_quantile'], rng)
+    return setup
+
+
+def advanced_population(rng, pop_size, n_ticks):
+    """
+    Population of Agent objects after n_ticks ticks of the object engine (the attack has started, agents have shared)
+    """
+    population = create_population(False, pop_size, PARAMS['prob_share_indifferent'], PARAMS['prob_prebunk'],
+                                   PARAMS['prob_immune'], 5, 5, PARAMS['dark_quantile'], rng)
+    schedule = attack_schedule(0, PARAMS['attack_start'], n_ticks).tolist()
+    for tick in range(n_ticks):
+        get_opinion_shares_and_agent_proportion(population)
+        for agent in population:
+            if agent.dark:
+                agent.attack(schedule[tick])
+            else:
+                agent.share()
+        for agent in population:
+            agent.check_friends()
+        for agent in population:
+            agent.update_opinion(PARAMS['prob_share_indifferent'], PARAMS['prob_share_disinfo'],
+                                 PARAMS['prob_share_facts'])
+    return population
+
+
+def bench_object_phase(phase, pop_size):
+    """
+    One phase of the tick at the attack start of the object engine (the phases before it are run in the setup)
+    """
+    tick = PARAMS['attack_start']
+    frequency = int(attack_schedule(0, PARAMS['attack_start'], tick + 1)[tick])
+
+    def share(population):
+        for agent in population:
+            if agent.dark:
+                agent.attack(frequency)
+            else:
+                agent.share()
+
+    def check_friends(population):
+        for agent in population:
+            agent.check_friends()
+
+    def update_opinion(population):
+        for agent in population:
+            agent.update_opinion(PARAMS['prob_share_indifferent'], PARAMS['prob_share_disinfo'],
+                                 PARAMS['prob_share_facts'])
+
+    phases = [get_opinion_shares_and_agent_proportion, share, check_friends, update_opinion]
+    names = ['count', 'share', 'check_friends', 'update_opinion']
+
+    def setup(rng):
+        population = advanced_population(rng, pop_size, tick)
+        for before in phases[:names.index(phase)]:
+            before(population)
+        return lambda: phases[names.index(phase)](population)
+    return setup
+
+
+def bench_array_phase(phase, pop_size, n_reps):
+    """
+    One phase of the tick at the attack start of the numpy engine for n_reps replicates
+    """
+    tick = PARAMS['attack_start']
+    frequency = int(attack_schedule(0, PARAMS['attack_start'], tick + 1)[tick])
+
+    def setup(rng):
+        graphs = [friend_graph(pop_size, 5, 5, PARAMS['dark_quantile'], rng) for _ in range(n_reps)]
+        pop = arrayModel.ArrayPopulation.from_graphs([(indptr, indices, light, dark)
+                                                      for indptr, indices, in_degree, light, dark in graphs],
+                                                     PARAMS['prob_share_indifferent'], PARAMS['prob_prebunk'],
+                                                     PARAMS['prob_immune'])
+        generator = np.random.default_rng(rng.getrandbits(64))
+        arrayModel.simulate(pop, tick, PARAMS['prob_share_indifferent'], PARAMS['prob_share_disinfo'],
+                            PARAMS['prob_share_facts'], PARAMS['attack_start'], 0, generator)
+        if phase == 'count':
+            return lambda: arrayModel.count(pop)
+        arrayModel.count(pop)
+        if phase == 'share':
+            return lambda: arrayModel.share(pop, generator, frequency)
+        arrayModel.share(pop, generator, frequency)
+        if phase == 'check_friends':
+            return lambda: arrayModel.check_friends(pop, generator)
+        next_opinion = arrayModel.check_friends(pop, generator)
+        return lambda: arrayModel.update_opinion(pop, next_opinion, PARAMS['prob_share_indifferent'],
+                                                 PARAMS['prob_share_disinfo'], PARAMS['prob_share_facts'])
+    return setup
+
+
+def bench_run_model(attack_kind, engine):
+    def setup(rng):
+        return lambda: run_model(pop_size=100, n_ticks=100, n_friends=5, n_add=5, attack_kind=attack_kind,
+                                 engine=engine, rng=rng, **PARAMS)
+    return setup
+
+
+def bench_sweep_cell(n_reps):
+    """
+    One cell of the sweep in main.py (all replicates of one parameter combination)
+    """
+    def setup(rng):
+        cell = sweep_cell({axis: .5 for axis in SWEEP_AXES}, 0, PARAMS['attack_start'], rng.getrandbits(32),
+                          n_reps=n_reps)
+        return lambda: run_cell(cell)
+    return setup
+
+
+BENCHMARKS = {}
+for pop_size in (100, 1000, 10000):
+    for n_friends, n_add in ((5, 5), (10, 1)):
+        BENCHMARKS[f'create_population[pop={pop_size},friends={n_friends},add={n_add}]'] = \
+            bench_create_population(pop_size, n_friends, n_add)
+for phase in ('count', 'share', 'check_friends', 'update_opinion'):
+    BENCHMARKS[f'tick.object.{phase}[pop=10000]'] = bench_object_phase(phase, 10000)
+for phase in ('count', 'share', 'check_friends', 'update_opinion'):
+    BENCHMARKS[f'tick.numpy.{phase}[pop=1000,reps=100]'] = bench_array_phase(phase, 1000, 100)
+for attack_kind in range(4):
+    for engine in ('object', 'numpy'):
+        BENCHMARKS[f'run_model.{engine}[attack_kind={attack_kind}]'] = bench_run_model(attack_kind, engine)
+BENCHMARKS['sweep_cell[reps=100]'] = bench_sweep_cell(100)
+
+
+# Cold start budgets of the simulation core (what every worker process imports): wall time in seconds and peak RSS in
+# MiB of a fresh interpreter importing the module, and modules it must not load (the plotting stack is only imported
+# by runs that draw)
+IMPORT_BUDGETS = {
+    'Agent': dict(seconds=.1, rss=20),
+    'runModel': dict(seconds=.5, rss=50),
+    'runSweep': dict(seconds=.75, rss=60),
+}
+FORBIDDEN_IMPORTS = ('matplotlib', 'networkx', 'pandas', 'scipy')
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+# Peak RSS of this process in MiB (ru_maxrss would include the RSS of the parent at the fork)
+with open('/proc/self/status') as file:
+    rss = next(int(line.split()[1]) for line in file if line.startswith('VmHWM')) / 1024
+print(json.dumps(dict(seconds=seconds, rss=rss, loaded=[name for name in {forbidden!r} if name in sys.modules])))
+"""
+
+
+def check_imports(repeats=3):
+    """
+    Import every module of IMPORT_BUDGETS in fresh interpreters (the fastest of repeats counts, the first import
+    also pays for cold file caches)
+    returns the measurements and the list of violated budgets
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    violations = []
+    for module, budget in IMPORT_BUDGETS.items():
+        probe = IMPORT_PROBE.format(module=module, forbidden=FORBIDDEN_IMPORTS)
+        runs = [json.loads(subprocess.run([sys.executable, '-c', probe], cwd=directory, capture_output=True,
+                                          text=True, check=True).stdout) for _ in range(repeats)]
+        result = results[module] = dict(seconds=min(run['seconds'] for run in runs),
+                                        rss=min(run['rss'] for run in runs), loaded=runs[0]['loaded'])
+        problems = []
+        if result['seconds'] > budget['seconds']:
+            problems.append(f"{result['seconds']:.3f} s > {budget['seconds']} s")
+        if result['rss'] > budget['rss']:
+            problems.append(f"{result['rss']:.1f} MiB > {budget['rss']} MiB")
+        if result['loaded']:
+            problems.append('imports ' + ', '.join(result['loaded']))
+        violations.extend(f'import {module}: {problem}' for problem in problems)
+        print(f"{'import.' + module:55s} {result['seconds'] * 1000:10.2f} ms {result['rss']:9.2f} MiB RSS"
+              f"{'  OVER BUDGET' if problems else ''}")
+    return results, violations
+
+
+def measure(setup, repeats, seed=0):
+    """
+    Wall time of every repeat (the setup is not timed) and the peak memory allocated by one further run (traced
+    separately, tracemalloc slows down the run)
+    """
+    times = []
+    for _ in range(repeats):
+        run = setup(rand.Random(seed))
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    run = setup(rand.Random(seed))
+    tracemalloc.start()
+    run()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(time_min=min(times), time_median=statistics.median(times), repeats=repeats, peak_memory=peak_memory)
+
+
+def run_benchmarks(select=None, repeats=5):
+    """
+    Run all benchmarks whose name contains select (all by default)
+    returns the report: the environment and the timings and peak memory of every benchmark
+    """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if select is not None and select not in name:
+            continue
+        result = results[name] = measure(setup, repeats)
+        print(f"{name:55s} {result['time_median'] * 1000:10.2f} ms {result['peak_memory'] / 2 ** 20:9.2f} MiB")
+
+    return dict(
+        environment=dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(),
+                         processor=platform.processor(), system=platform.system(), code_version=code_version(),
+                         timestamp=time.strftime('%Y-%m-%dT%H:%M:%S')),
+        results=results,
+    )
+
+
+def compare(report, baseline, threshold=.2):
+    """
+    Compare a report with a baseline report, a benchmark regressed if its median time or its peak memory grew by more
+    than threshold (relative)
+    returns the names of the regressed benchmarks
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]
+        time_ratio = result['time_median'] / base['time_median']
+        memory_ratio = result['peak_memory'] / max(base['peak_memory'], 1)
+        regressed = time_ratio > 1 + threshold or memory_ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:55s} time x{time_ratio:5.2f} memory x{memory_ratio:5.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation hot paths.')
+    parser.add_argument('--output', default='benchmark_report.json',
+                        help='file the report is written to (default benchmark_report.json), '
+                             'pass --output benchmark_baseline.json to refresh the committed baseline')
+    parser.add_argument('--baseline', default='benchmark_baseline.json',
+                        help='report to compare with (default benchmark_baseline.json, the committed report of the '
+                             'last release, skipped if missing)')
+    parser.add_argument('--threshold', type=float, default=.2,
+                        help='relative growth of time or memory that counts as regression (default 0.2)')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs per benchmark (default 5)')
+    parser.add_argument('--select', help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--imports', action='store_true', help='only check the import budgets of the simulation core')
+    args = parser.parse_args()
+
+    imports, violations = check_imports()
+    for violation in violations:
+        print(violation)
+    if args.imports:
+        sys.exit(1 if violations else 0)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    report = run_benchmarks(args.select, args.repeats)
+    report['imports'] = imports
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(len(regressions), 'benchmarks regressed by more than', f'{args.threshold:.0%}.')
+            sys.exit(1)
+    if violations:
+        sys.exit(1)
@@ -0,0 +1,48 @@
+import numpy as np
+
+# Rows of the uniforms of one tick, one per random decision of an agent
+SHARE, PREBUNK, IMMUNIZE = range(3)
+
+
+def common_seed(root_seed):
+    """
+    Seed of the common random numbers of a sweep, derived only from the root seed so that every cell gets the same one
+    (its spawn key cannot collide with the spawn keys of runSweep.cell_seed)
+    """
+    return int(np.random.SeedSequence(root_seed, spawn_key=[0]).generate_state(1, np.uint64)[0])
+
+
+class CommonRandom:
+    """
+    Common random numbers (variance reduction across sweep cells): every replicate has its own stream of uniform draws
+    that depends only on the seed and the index of the replicate, never on the parameters of a cell. Every tick takes
+    one block of draws per agent and decision from it:
+    SHARE          the share decision of Agent.share (the agent shares if u <= prob_share_opinion)
+    PREBUNK        the prebunk decision of Agent.check_friends (the agent becomes resistant if u < prob_prebunk)
+    IMMUNIZE       the immunize decision of Agent.check_friends (the agent shares prebunking if u < prob_immunize)
+    The blocks are drawn whether a decision comes up or not, so agent a of replicate r faces the same draws at tick t
+    in every cell and the results of neighbouring cells differ by the effect of the parameter change rather than by
+    sampling noise. The friend graphs are only common if the cells run on a graph bank, the shares drawn by fast-forward
+    are not common.
+    """
+
+    def __init__(self, seed, pop_size, replicates=(0,)):
+        """
+        seed: (int)
+            seed shared by all cells, see common_seed
+        pop_size: (int)
+            number of agents per replicate
+        replicates: (iterable)
+            [(0,)]: indices of the replicates, e.g. their graphs in the graph bank, replicate r draws from stream (seed, r)
+        """
+        self.pop_size = pop_size
+        self.generators = [np.random.default_rng([seed, r]) for r in replicates]
+
+    def draw(self, active=None):
+        """
+        Uniforms of the next tick for the replicates at the positions active (all by default), shape
+        (3, len(active) * pop_size) with the agents in the order of arrayModel.ArrayPopulation. Replicates left out
+        fall behind the others, they must not be drawn for again (e.g. fast-forwarded replicates).
+        """
+        generators = self.generators if active is None else [self.generators[i] for i in active]
+        return np.concatenate([generator.random((3, self.pop_size)) for generator in generators], axis=1)
@@ -0,0 +1,145 @@
+import random as rand
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+
+def friend_graph(pop_size, n_friends, n_add, dark_quantile, rng=rand, n_light=1, n_dark=1):
+    """
+    Preferential attachment friend graph with the same semantics (and, for the same rng state, the same result) as the
+    original list based algorithm of create_population (legacy_friend_graph):
+    In n_friends rounds every agent gets one more friend drawn from the 'chosen' list, which initially holds every agent
+    once and gets n_add more copies of an agent every time it is chosen as a friend. Draws of the agent itself or of a
+    friend it already has are rejected. The light agent is the most chosen agent, the dark agent a random agent among
+    the other agents whose number of entries in 'chosen' is the dark_quantile of all agents (see light_and_dark for
+    several light and dark agents).
+
+    The chosen list is never materialized: entry k < pop_size is agent k and entry k >= pop_size is the target of edge
+    (k - pop_size) // n_add, so a draw is one index lookup and the memory is linear in the edges.
+
+    pop_size: (int)
+        number of agents, has to be larger than n_friends
+    n_friends: (int)
+        number of friends of every agent
+    n_add: (int)
+        number of additional entries an agent gets in the chosen list when it is chosen as a friend
+    dark_quantile: (float)
+        quantile of the chosen counts that determines the dark agent
+    rng: (random.Random)
+        [random]: source of the random draws
+    n_light, n_dark: (int)
+        [1]: number of light and dark agents
+
+    returns indptr, indices (CSR adjacency, friends of agent a are indices[indptr[a]:indptr[a + 1]]), the in-degree of
+    every agent and the ids of the light and the dark agents (arrays)
+    """
+    if pop_size <= n_friends:
+        raise ValueError("pop_size has to be larger than n_friends.")
+
+    friends = array('q', bytes(8 * pop_size * n_friends))  # friends of agent a at a * n_friends + round
+    targets = array('q')  # target of every accepted edge, in the order the edges were added
+    randrange = rng.randrange
+
+    for i in range(n_friends):
+        for agent in range(pop_size):
+            row = agent * n_friends
+            while True:
+                k = randrange(pop_size + n_add * len(targets))
+                fr = k if k < pop_size else targets[(k - pop_size) // n_add]
+                if fr != agent and fr not in friends[row:row + i]:
+                    friends[row + i] = fr
+                    targets.append(fr)
+                    break
+
+    in_degree = np.bincount(np.frombuffer(targets, dtype=np.int64), minlength=pop_size)
+    light, dark = light_and_dark(in_degree, n_add, dark_quantile, rng, n_light, n_dark)
+
+    index_dtype = np.int32 if pop_size < 2 ** 31 else np.int64
+    indptr = np.arange(pop_size + 1, dtype=np.int64) * n_friends
+    indices = np.frombuffer(friends, dtype=np.int64).astype(index_dtype)
+
+    return indptr, indices, in_degree, light, dark
+
+
+def light_and_dark(in_degree, n_add, dark_quantile, rng=rand, n_light=1, n_dark=1):
+    """
+    Choose the light agents (the n_light most chosen agents, lowest ids on ties) and the dark agents (n_dark random
+    agents besides the light agents whose chosen count is the dark_quantile of all chosen counts, if there are fewer
+    such agents the ones with the nearest counts are added) from the in-degrees. A single dark agent is drawn like the
+    original algorithm, except that it can no longer be the light agent.
+    returns the ids of the light and of the dark agents as arrays
+    """
+    chosen_counts = 1 + n_add * in_degree
+    if not (1 <= n_light <= len(chosen_counts) and n_dark >= 1):
+        raise ValueError("n_light has to be between 1 and the number of agents, n_dark at least 1.")
+    light = np.argsort(-chosen_counts, kind='stable')[:n_light]
+    candidates = np.setdiff1d(np.arange(len(chosen_counts)), light)
+    if len(candidates) < n_dark:
+        raise ValueError(f"Only {len(candidates)} agents besides the light agents are left for the {n_dark} dark "
+                         f"agents.")
+
+    med_in = np.quantile(chosen_counts, dark_quantile, method='nearest')
+    distance = np.abs(chosen_counts[candidates] - med_in)
+    boundary = np.sort(distance)[n_dark - 1]
+    nearer = candidates[distance < boundary]
+    m_list = candidates[distance == boundary]
+    picked = m_list[rng.sample(range(len(m_list)), n_dark - len(nearer))]
+    dark = np.sort(np.concatenate([nearer, picked]))
+    return light, dark
+
+
+def legacy_friend_graph(pop_size, n_friends, n_add, dark_quantile, rng=rand):
+    """
+    The original friendship algorithm of create_population on agent ids, kept as reference for check_equivalence
+    returns the friend lists of all agents and the ids of the light and the dark agent
+    """
+    friends = [[] for _ in range(pop_size)]
+    chosen = list(range(pop_size))
+
+    for i in range(n_friends):
+        for agent in range(pop_size):
+            while len(friends[agent]) < i + 1:
+                fr = rng.choice(chosen)
+                if fr != agent and fr not in friends[agent]:
+                    friends[agent].append(fr)
+                    chosen.extend([fr] * n_add)
+
+    light = Counter(chosen).most_common(1)[0][0]
+    incoming_edges = Counter(chosen)
+    n_list = list(incoming_edges.values())
+    med_in = np.quantile(n_list, dark_quantile, method='nearest')
+    m_list = [c for c, v in incoming_edges.items() if v == med_in]
+    dark = rng.choice(m_list)
+
+    return friends, light, dark
+
+
+def check_equivalence(pop_size=100, n_friends=5, n_add=5, dark_quantile=.75, seeds=range(20)):
+    """
+    Equivalence test of friend_graph against legacy_friend_graph: for every seed both generators are run from the same
+    random.Random state and have to produce the same friend lists, light agent and dark agent (raises AssertionError
+    otherwise)
+    """
+    for seed in seeds:
+        legacy_friends, legacy_light, legacy_dark = legacy_friend_graph(pop_size, n_friends, n_add, dark_quantile,
+                                                                        rand.Random(seed))
+        indptr, indices, in_degree, light, dark = friend_graph(pop_size, n_friends, n_add, dark_quantile,
+                                                               rand.Random(seed))
+        friends = [indices[indptr[a]:indptr[a + 1]].tolist() for a in range(pop_size)]
+        assert friends == legacy_friends, f"friend lists differ for seed {seed}"
+        assert (light.tolist(), dark.tolist()) == ([legacy_light], [legacy_dark]), \
+            f"light or dark agent differs for seed {seed}"
+        assert in_degree.tolist() == [sum(row.count(a) for row in legacy_friends) for a in range(pop_size)]
+
+
+if __name__ == '__main__':
+    check_equivalence()
+    check_equivalence(pop_size=500, n_friends=8, n_add=3, dark_quantile=.5, seeds=range(5))
+    print('friend_graph is equivalent to the original algorithm.')
+
+    for pop_size in (10 ** 3, 10 ** 4, 10 ** 5):
+        start = time.perf_counter()
+        friend_graph(pop_size, 5, 5, .75, rand.Random(311))
+        print('pop_size:', pop_size, 'seconds:', round(time.perf_counter() - start, 3))
@@ -0,0 +1,109 @@
+from collections import Counter
+
+from commonRandom import SHARE, PREBUNK, IMMUNIZE
+
+
+class ActiveFrontier:
+    """
+    Event-driven tick scheduler for a population of Agent objects. Instead of visiting every agent in every phase it
+    keeps
+    followers      the reverse adjacency (agents that have an agent as friend)
+    sharers        the agents with a sharing probability above zero, only they draw in the share phase
+    engaged        the agents that shared in the last tick
+    status_counts  the number of agents per status, updated on every status change
+
+    and evaluates check_friends only for susceptible agents with at least one friend that shared disinformation or
+    fact checking in this tick (the only agents that can change). The per tick cost is therefore proportional to the
+    sharing agents and their edges, not to pop_size.
+    """
+
+    def __init__(self, population):
+        self.followers = [[] for _ in population]
+        for agent in population:
+            for friend in agent.friends:
+                self.followers[friend.node_id].append(agent)
+
+        self.sharers = {agent: None for agent in population if agent.prob_share_opinion > 0}  # ordered set
+        self.engaged = []
+        self.status_counts = Counter(agent.status for agent in population)
+
+    def count(self):
+        """
+        Same as get_opinion_shares_and_agent_proportion, but only visits the engaged agents
+        """
+        engagement_counts = [0, 0, 0]
+        for agent in self.engaged:
+            engagement_counts[agent.opinion] += agent.engagement
+            agent.engagement = 0  # Clear engagement after counting
+
+        return (*engagement_counts, self.status_counts["S"], self.status_counts["I"], self.status_counts["R"],
+                self.status_counts["aR"], self.status_counts["uI"])
+
+    def is_absorbing(self):
+        """
+        Same as runModel.is_absorbing, but checked from the sharers: the population is absorbing when no sharer of
+        disinformation has a susceptible follower and no sharer of fact checking a susceptible follower that can still
+        be immunized
+        """
+        for agent in self.sharers:
+            if agent.opinion:
+                for follower in self.followers[agent.node_id]:
+                    if not follower.resistance and (agent.opinion == 1 or follower.prob_prebunk > 0):
+                        return False
+        return True
+
+    def step(self, frequency, prob_share_indifferent, prob_share_disinfo, prob_share_facts, profiler=None,
+             uniforms=None):
+        """
+        One tick: share (sharers only), check_friends (active frontier only) and update_opinion (frontier only),
+        frequency is the attack frequency of the dark agents at this tick
+        profiler: (phaseProfiler.PhaseProfiler)
+            [None]: records the wall time and counters of the three phases
+        uniforms: (list)
+            [None]: common random numbers of the tick, rows SHARE, PREBUNK and IMMUNIZE by node id (see commonRandom)
+        """
+        self.engaged = []
+        for agent in self.sharers:
+            u = None if uniforms is None else uniforms[SHARE][agent.node_id]
+            if agent.dark:
+                agent.attack(frequency, u)
+            else:
+                agent.share(u)
+            if agent.engagement:
+                self.engaged.append(agent)
+        if profiler is not None:
+            profiler.lap('share', agents=len(self.sharers))
+            profiler.add('share', engagement=sum(agent.engagement for agent in self.engaged))
+
+        # Susceptible followers of agents that shared disinformation (1) or fact checking (2)
+        frontier = {}
+        for agent in self.engaged:
+            if agent.opinion:
+                for follower in self.followers[agent.node_id]:
+                    if not follower.resistance:
+                        frontier[follower] = None
+
+        old_status = [agent.status for agent in frontier]
+        for agent in frontier:
+            if uniforms is None:
+                agent.check_friends()
+            else:
+                agent.check_friends(uniforms[PREBUNK][agent.node_id], uniforms[IMMUNIZE][agent.node_id])
+        if profiler is not None:
+            profiler.lap('check_friends', agents=len(frontier))
+            old_opinions = [agent.opinion for agent in frontier]
+            profiler.start()
+
+        for agent, status in zip(frontier, old_status):
+            agent.update_opinion(prob_share_indifferent, prob_share_disinfo, prob_share_facts)
+            if agent.status != status:
+                self.status_counts[status] -= 1
+                self.status_counts[agent.status] += 1
+            if agent.prob_share_opinion > 0:
+                self.sharers[agent] = None
+            else:
+                self.sharers.pop(agent, None)
+        if profiler is not None:
+            profiler.lap('update_opinion', agents=len(frontier))
+            profiler.add('update_opinion', transitions=sum(agent.opinion != opinion
+                                                           for agent, opinion in zip(frontier, old_opinions)))
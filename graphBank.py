@@ -0,0 +1,103 @@
+import functools
+import os
+import random as rand
+
+import numpy as np
+from friendGraph import friend_graph
+
+
+class GraphBank:
+    """
+    A fixed set of friend graphs (with their light and dark agents) generated once for given topology parameters, so
+    that all sweep cells run their replicates on the same networks. Every agent has exactly n_friends friends, the
+    graphs are therefore stored as one (n_graphs, pop_size, n_friends) array of the smallest integer type that holds
+    the agent ids.
+    """
+
+    def __init__(self, friends, light, dark, n_add, dark_quantile, seed):
+        """
+        friends: (np.ndarray)
+            (n_graphs, pop_size, n_friends) friends of every agent in every graph
+        light, dark: (np.ndarray)
+            (n_graphs, n_light) and (n_graphs, n_dark) ids of the light and the dark agents of every graph (banks saved
+            with a single light and dark agent per graph hold (n_graphs,) arrays)
+        n_add, dark_quantile, seed: parameters the bank was generated with
+        """
+        self.friends = friends
+        self.light = light.reshape(len(light), -1)
+        self.dark = dark.reshape(len(dark), -1)
+        self.n_add = n_add
+        self.dark_quantile = dark_quantile
+        self.seed = seed
+        self.n_graphs, self.pop_size, self.n_friends = friends.shape
+        self.n_light = self.light.shape[1]
+        self.n_dark = self.dark.shape[1]
+
+    def __len__(self):
+        return self.n_graphs
+
+    @classmethod
+    def generate(cls, n_graphs, pop_size, n_friends, n_add, dark_quantile, seed, n_light=1, n_dark=1):
+        """
+        Generate n_graphs friend graphs with friend_graph from one random.Random(seed) stream
+        """
+        rng = rand.Random(seed)
+        friends = np.zeros((n_graphs, pop_size, n_friends), dtype=np.min_scalar_type(pop_size - 1))
+        light = np.zeros((n_graphs, n_light), dtype=np.int64)
+        dark = np.zeros((n_graphs, n_dark), dtype=np.int64)
+        for g in range(n_graphs):
+            indptr, indices, in_degree, light[g], dark[g] = friend_graph(pop_size, n_friends, n_add, dark_quantile, rng,
+                                                                         n_light, n_dark)
+            friends[g] = indices.reshape(pop_size, n_friends)
+        return cls(friends, light, dark, n_add, dark_quantile, seed)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, friends=self.friends, light=self.light, dark=self.dark,
+                            n_add=self.n_add, dark_quantile=self.dark_quantile, seed=self.seed)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['friends'], data['light'], data['dark'],
+                       int(data['n_add']), float(data['dark_quantile']), int(data['seed']))
+
+    @classmethod
+    def load_or_generate(cls, path, n_graphs, pop_size, n_friends, n_add, dark_quantile, seed, n_light=1, n_dark=1):
+        """
+        Load the bank stored at path, generate and store it if it does not exist yet
+        """
+        if os.path.exists(path):
+            bank = cls.load(path)
+            if (bank.n_graphs, bank.pop_size, bank.n_friends, bank.n_add, bank.dark_quantile, bank.seed, bank.n_light,
+                    bank.n_dark) != (n_graphs, pop_size, n_friends, n_add, dark_quantile, seed, n_light, n_dark):
+                raise ValueError(f"Graph bank at {path} was generated with different parameters.")
+            return bank
+        bank = cls.generate(n_graphs, pop_size, n_friends, n_add, dark_quantile, seed, n_light, n_dark)
+        bank.save(path)
+        return bank
+
+    def graph(self, g):
+        """
+        Graph g in the form returned by friend_graph without the in-degrees: indptr, indices, light, dark
+        """
+        indptr = np.arange(self.pop_size + 1, dtype=np.int64) * self.n_friends
+        return indptr, self.friends[g].ravel().astype(np.int64), self.light[g].astype(np.int64), \
+            self.dark[g].astype(np.int64)
+
+
+def bank_path(directory, n_graphs, pop_size, n_friends, n_add, dark_quantile, seed, n_light=1, n_dark=1):
+    """
+    File name of a bank, it holds all parameters the bank is generated from (the numbers of light and dark agents
+    only if they differ from one, so banks of single light and dark agents keep their names)
+    """
+    agents = f"_light{n_light}_dark{n_dark}" if (n_light, n_dark) != (1, 1) else ''
+    return os.path.join(directory, f"graphs_n{n_graphs}_pop{pop_size}_fr{n_friends}_add{n_add}_q{dark_quantile}_s{seed}{agents}.npz")
+
+
+@functools.lru_cache(maxsize=4)
+def load_bank(path):
+    """
+    Load a bank once per process (sweep workers run many cells on the same bank)
+    """
+    return GraphBank.load(path)
@@ -0,0 +1,305 @@
+import json
+import os
+import random as rand
+
+import numpy as np
+from arrayModel import STATUS_CODES, S, I, R, AR, UI
+from attacks import attack_schedule
+from friendGraph import friend_graph
+
+# Bytes per agent of the simulation state: opinion, next opinion, status (int8), resistance (bool), engagement (int32)
+STATE_BYTES = 8
+# Upper bound of the temporary bytes per agent and per edge of a chunk (random draws, gathered friend values, counts)
+CHUNK_AGENT_BYTES = 64
+CHUNK_EDGE_BYTES = 40
+# Default number of agents processed at once
+CHUNK_SIZE = 2 ** 20
+
+
+class LargeGraph:
+    """
+    Friend graph of a single large population as int32 CSR adjacency, the friends of agent a are
+    indices[indptr[a]:indptr[a + 1]]. The arrays can be saved to a directory and opened memory-mapped from it, the
+    graph then only occupies page cache and is read in chunks during a run.
+    indptr         (int32, int64 from 2 ** 31 edges) offsets of the friend lists
+    indices        (int32) friend ids
+    light, dark    (int64) ids of the light and the dark agents
+    """
+
+    def __init__(self, indptr, indices, light, dark):
+        self.indptr = indptr
+        self.indices = indices
+        self.light = np.atleast_1d(np.asarray(light, dtype=np.int64))
+        self.dark = np.atleast_1d(np.asarray(dark, dtype=np.int64))
+        self.pop_size = len(indptr) - 1
+        self.n_edges = len(indices)
+
+    @classmethod
+    def generate(cls, pop_size, n_friends, n_add, dark_quantile, rng=rand, n_light=1, n_dark=1):
+        """
+        Generate the graph with friend_graph (same graph as create_population for the same rng state)
+        """
+        indptr, indices, in_degree, light, dark = friend_graph(pop_size, n_friends, n_add, dark_quantile, rng,
+                                                               n_light, n_dark)
+        return cls.from_csr(indptr, indices, light, dark)
+
+    @classmethod
+    def from_csr(cls, indptr, indices, light, dark):
+        """
+        Graph from any CSR adjacency (e.g. GraphBank.graph(g)), converted to the smallest index types
+        """
+        offset_dtype = np.int32 if len(indices) < 2 ** 31 else np.int64
+        return cls(np.asarray(indptr, dtype=offset_dtype), np.asarray(indices, dtype=np.int32), light, dark)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(directory, 'indices.npy'), self.indices)
+        with open(os.path.join(directory, 'graph.json'), 'w') as file:
+            json.dump(dict(light=self.light.tolist(), dark=self.dark.tolist()), file)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Open a saved graph, memory-mapped (read only) by default
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'graph.json')) as file:
+            meta = json.load(file)
+        return cls(np.load(os.path.join(directory, 'indptr.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, 'indices.npy'), mmap_mode=mmap_mode),
+                   meta['light'], meta['dark'])
+
+    @property
+    def mapped(self):
+        return isinstance(self.indices, np.memmap)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes
+
+
+def estimate_memory(pop_size, n_edges, chunk_size, mapped=False):
+    """
+    Upper bound of the resident bytes of a run with the large engine
+    returns dict(graph=..., state=..., chunk=..., total=...), the graph counts as zero if it is memory-mapped
+    """
+    chunk_agents = min(chunk_size, pop_size)
+    chunk_edges = int(np.ceil(n_edges / max(pop_size, 1) * chunk_agents))
+    memory = dict(
+        graph=0 if mapped else 4 * (pop_size + 1) + 4 * n_edges,
+        state=STATE_BYTES * pop_size,
+        chunk=CHUNK_AGENT_BYTES * chunk_agents + CHUNK_EDGE_BYTES * chunk_edges,
+    )
+    memory['total'] = sum(memory.values())
+    return memory
+
+
+def fit_chunk_size(graph, memory_limit, chunk_size):
+    """
+    Largest chunk size (at most chunk_size) for which a run on graph stays within memory_limit bytes
+    """
+    fixed = estimate_memory(graph.pop_size, graph.n_edges, 0, graph.mapped)['total']
+    per_agent = CHUNK_AGENT_BYTES + CHUNK_EDGE_BYTES * graph.n_edges / max(graph.pop_size, 1)
+    fitting = int((memory_limit - fixed) // per_agent)
+    if fitting < 1:
+        raise MemoryError(f"The graph and the state need {fixed / 2 ** 20:.1f} MiB, the limit is "
+                          f"{memory_limit / 2 ** 20:.1f} MiB (open the graph memory-mapped to not count it).")
+    return min(chunk_size, fitting)
+
+
+class LargePopulation:
+    """
+    State of a single large population in compact arrays (STATE_BYTES per agent). The sharing probability is not
+    stored per agent, it follows from the opinion (and is 1 for the light and the dark agents), the attack frequency
+    only applies to the dark agents.
+    """
+
+    def __init__(self, graph, prob_share_indifferent, prob_share_disinfo, prob_share_facts, prob_prebunk, prob_immunize,
+                 share_friends_opinion=.5):
+        n = graph.pop_size
+        self.graph = graph
+        self.opinion = np.zeros(n, dtype=np.int8)
+        self.next_opinion = np.zeros(n, dtype=np.int8)
+        self.status = np.full(n, S, dtype=np.int8)
+        self.resistance = np.zeros(n, dtype=bool)
+        self.engagement = np.zeros(n, dtype=np.int32)
+        self.prob_by_opinion = np.array([prob_share_indifferent, prob_share_disinfo, prob_share_facts])
+        self.prob_prebunk = prob_prebunk
+        self.prob_immunize = prob_immunize
+        self.share_friends_opinion = share_friends_opinion
+
+        # Same order as create_population: the light agents are altered first, the dark agents afterwards
+        self.opinion[graph.light], self.status[graph.light] = 2, AR
+        self.opinion[graph.dark], self.status[graph.dark] = 1, UI
+        self.resistance[graph.light] = self.resistance[graph.dark] = True
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.opinion, self.next_opinion, self.status, self.resistance,
+                                              self.engagement))
+
+
+def chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield start, min(start + chunk_size, n)
+
+
+def count(pop, chunk_size):
+    """
+    Shares per opinion (3) and number of agents per status (5), clears the engagement
+    """
+    shares = np.zeros(3, dtype=np.int64)
+    status = np.zeros(len(STATUS_CODES), dtype=np.int64)
+    for start, stop in chunks(pop.graph.pop_size, chunk_size):
+        shares += np.bincount(pop.opinion[start:stop], weights=pop.engagement[start:stop], minlength=3).astype(np.int64)
+        status += np.bincount(pop.status[start:stop], minlength=len(STATUS_CODES))
+    pop.engagement[:] = 0
+    return shares, status
+
+
+def share(pop, rng, frequency, chunk_size):
+    """
+    Every agent shares once with the sharing probability of its opinion, the dark agents share with the attack
+    frequency of the tick
+    """
+    for start, stop in chunks(pop.graph.pop_size, chunk_size):
+        prob = pop.prob_by_opinion[pop.opinion[start:stop]]
+        pop.engagement[start:stop] = rng.random(stop - start) <= prob
+    # Light and dark agents share with probability 1
+    pop.engagement[pop.graph.light] = 1
+    pop.engagement[pop.graph.dark] = frequency
+
+
+def check_friends(pop, rng, chunk_size):
+    """
+    Same rules as arrayModel.check_friends. The engagement every agent reads from its friends per opinion is the sparse
+    product of the adjacency with the per opinion engagement vectors, computed as sums over the CSR rows of one chunk of
+    agents at a time (only edges to friends that shared are gathered). Fills next_opinion and updates status and
+    resistance.
+    """
+    graph = pop.graph
+    for start, stop in chunks(graph.pop_size, chunk_size):
+        indptr = np.asarray(graph.indptr[start:stop + 1], dtype=np.int64)
+        friends = np.asarray(graph.indices[indptr[0]:indptr[-1]])
+        engagement = pop.engagement[friends]
+        shared = engagement > 0
+        rows = np.repeat(np.arange(stop - start, dtype=np.int32), np.diff(indptr))[shared]
+        friends = friends[shared]
+        n_by_opinion = np.bincount(rows * 3 + pop.opinion[friends], weights=engagement[shared],
+                                   minlength=3 * (stop - start)).reshape(-1, 3)
+        n_all = n_by_opinion.sum(axis=1)
+        n_1 = n_by_opinion[:, 1]
+        n_2 = n_by_opinion[:, 2]
+
+        susceptible = ~pop.resistance[start:stop]
+        prob = np.divide(n_1, n_all, out=np.zeros(stop - start), where=n_all > 0)
+        infected = susceptible & (n_1 > 0) & (prob > pop.share_friends_opinion)
+        exposed = susceptible & ~infected & (n_2 > 0)
+        resistant = exposed & (rng.random(stop - start) < pop.prob_prebunk)
+        active = resistant & (rng.random(stop - start) < pop.prob_immunize)
+
+        next_opinion = pop.next_opinion[start:stop]
+        next_opinion[:] = pop.opinion[start:stop]
+        next_opinion[infected] = 1
+        next_opinion[resistant] = 0
+        next_opinion[active] = 2
+
+        status = pop.status[start:stop]
+        status[infected] = I
+        status[resistant] = R
+        status[active] = AR
+        pop.resistance[start:stop] |= infected | resistant
+
+
+def update_opinion(pop):
+    """
+    The sharing probability follows from the opinion, only the opinion arrays are swapped
+    """
+    pop.opinion, pop.next_opinion = pop.next_opinion, pop.opinion
+
+
+def iter_simulate(graph, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts, attack_start,
+                  attack_kind, prob_prebunk, prob_immune, rng, chunk_size=CHUNK_SIZE, history=None, profiler=None):
+    """
+    Run the model on a LargeGraph tick by tick in chunks of chunk_size agents, same parameters as simulate
+    yields (tick, shares per opinion (3,), number of agents per status (5,)) counted at the start of every tick, the
+    next tick is only stepped when the next record is requested
+    """
+    schedule = attack_schedule(attack_kind, attack_start, n_ticks)
+    pop = LargePopulation(graph, prob_share_indifferent, prob_share_disinfo, prob_share_facts, prob_prebunk,
+                          prob_immune)
+    if history is not None:
+        history.start(pop.opinion)
+    if profiler is not None:
+        profiler.lap('create_population', agents=graph.pop_size)
+
+    for tick in range(n_ticks):
+        shares, status = count(pop, chunk_size)
+        if profiler is not None:
+            profiler.lap('count', agents=graph.pop_size)
+        yield tick, shares, status
+
+        share(pop, rng, schedule[tick], chunk_size)
+        if profiler is not None:
+            profiler.lap('share', agents=graph.pop_size)
+            profiler.add('share', engagement=pop.engagement.sum())
+
+        check_friends(pop, rng, chunk_size)
+        if profiler is not None:
+            profiler.lap('check_friends', agents=graph.pop_size)
+            profiler.add('update_opinion', transitions=np.count_nonzero(pop.next_opinion != pop.opinion))
+
+        update_opinion(pop)
+        if profiler is not None:
+            profiler.lap('update_opinion', agents=graph.pop_size)
+        if history is not None:
+            history.record(tick, pop.opinion)
+            if profiler is not None:
+                profiler.lap('history')
+
+
+def simulate(graph, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts, attack_start, attack_kind,
+             prob_prebunk, prob_immune, rng, chunk_size=CHUNK_SIZE, memory_limit=None, history=None, profiler=None):
+    """
+    Run the model on a LargeGraph with bounded memory, rng is a numpy Generator
+    chunk_size: (int)
+        [CHUNK_SIZE]: number of agents processed at once, bounds the temporary memory
+    memory_limit: (int)
+        [None]: maximum resident bytes of the run (see estimate_memory), the chunk size is reduced to fit and a
+        MemoryError is raised if the graph and the state alone exceed it
+    history: (opinionHistory.OpinionHistory)
+        [None]: recording policy for the opinions
+    profiler: (phaseProfiler.PhaseProfiler)
+        [None]: records the wall time and counters of every phase
+    returns the shares per opinion (n_ticks, 3), the number of agents per status (n_ticks, 5) and the memory estimate
+    of the run
+    """
+    if memory_limit is not None:
+        chunk_size = fit_chunk_size(graph, memory_limit, chunk_size)
+    memory = estimate_memory(graph.pop_size, graph.n_edges, chunk_size, graph.mapped)
+
+    shares = np.zeros((n_ticks, 3), dtype=np.int64)
+    status = np.zeros((n_ticks, len(STATUS_CODES)), dtype=np.int64)
+    for tick, tick_shares, tick_status in iter_simulate(graph, n_ticks, prob_share_indifferent, prob_share_disinfo,
+                                                        prob_share_facts, attack_start, attack_kind, prob_prebunk,
+                                                        prob_immune, rng, chunk_size, history, profiler):
+        shares[tick], status[tick] = tick_shares, tick_status
+    return shares, status, memory
+
+
+if __name__ == '__main__':
+    pop_size = 1000000
+    n_friends = 5
+    n_add = 5
+    graph_path = f'graphs/large_{pop_size}'
+    memory_limit = 256 * 2 ** 20
+
+    if not os.path.exists(os.path.join(graph_path, 'graph.json')):
+        LargeGraph.generate(pop_size, n_friends, n_add, .75, rand.Random(311)).save(graph_path)
+    graph = LargeGraph.load(graph_path)
+
+    shares, status, memory = simulate(graph, 100, .5, .5, .5, 5, 0, .5, .5, np.random.default_rng(311),
+                                      memory_limit=memory_limit)
+    print('Memory estimate (MiB):', {part: round(value / 2 ** 20, 1) for part, value in memory.items()})
+    print('Final status counts:', dict(zip(STATUS_CODES, status[-1].tolist())))
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+from resultStore import ResultStore
+
+
+def load_results(attack_kind, path='results'):
+    """
+    Open the result store of the sweep for the given attack kind (read only, memory-mapped)
+    attack_kind: (int)
+        attack kind of the sweep
+    path: (str)
+        ['results']: directory that holds the stores of all attack kinds (atk0, atk1, ...)
+    """
+    return SweepResults(ResultStore(os.path.join(path, f'atk{attack_kind}')))
+
+
+class SweepResults:
+    """
+    Query access to a result store by parameter values: every selection is a direct index lookup on the parameter
+    axes of the store, no rows are filtered or concatenated.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.axes = store.axes
+
+    def _index(self, params):
+        """
+        Index arrays (for np.ix_) and the selected values of every axis, a parameter can be a single value or a list of
+        values, missing parameters select the whole axis
+        """
+        unknown = set(params) - set(self.axes)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        index = []
+        values = []
+        for name, axis in self.axes.items():
+            if name in params:
+                selected = np.atleast_1d(params[name])
+                index.append(np.array([self.store.position(name, value) for value in selected]))
+                values.append(axis[index[-1]])
+            else:
+                index.append(np.arange(len(axis)))
+                values.append(axis)
+        return index, values
+
+    def array(self, metric, **params):
+        """
+        Slice of a metric as array with one axis per swept parameter (and the tick axis for time series), axes given as
+        a single value are dropped
+        """
+        index, _ = self._index(params)
+        array = self.store.data[metric][np.ix_(*index)]
+        squeeze = tuple(i for i, name in enumerate(self.axes) if name in params and np.ndim(params[name]) == 0)
+        return array.squeeze(axis=squeeze)
+
+    def select(self, metrics=None, **params):
+        """
+        Tidy frame with one row per selected (and computed) cell: the swept parameters, the attack kind and the scalar
+        metrics
+        metrics: (list)
+            [None]: scalar metrics to include, all by default
+        """
+        if metrics is None:
+            metrics = self.store.scalar_metrics
+        index, values = self._index(params)
+        grid = np.ix_(*index)
+        done = self.store.done[grid].ravel()
+
+        columns = np.meshgrid(*values, indexing='ij')
+        frame = pd.DataFrame({name: column.ravel()[done] for name, column in zip(self.axes, columns)})
+        frame.insert(0, 'attack_kind', self.store.attrs.get('attack_kind'))
+        for metric in metrics:
+            frame[metric] = self.store.data[metric][grid].ravel()[done]
+        return frame
+
+    def series(self, metrics=None, **params):
+        """
+        Tidy frame of time series metrics with one row per selected (and computed) cell and tick
+        metrics: (list)
+            [None]: time series metrics to include, all by default
+        """
+        if metrics is None:
+            metrics = self.store.series_metrics
+        frame = self.select(metrics=[], **params)
+        index, _ = self._index(params)
+        grid = np.ix_(*index)
+        done = self.store.done[grid].ravel()
+        n_ticks = self.store.n_ticks
+
+        frame = frame.loc[frame.index.repeat(n_ticks)].reset_index(drop=True)
+        frame['tick'] = np.tile(np.arange(n_ticks), len(frame) // n_ticks)
+        for metric in metrics:
+            frame[metric] = self.store.data[metric][grid].reshape(-1, n_ticks)[done].ravel()
+        return frame
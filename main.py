@@ -1,158 +1,77 @@
-import numpy as np
+import sys
+
 from runModel import run_model
-import pandas as pd
-import random as rand
+from runSweep import sweep_cells, sweep_attrs, run_sweep, PROB_VALUES, SWEEP_AXES
+from resultCache import ResultCache
+from resultStore import ResultStore, cell_metrics, store_metrics
+from graphBank import GraphBank, bank_path
+from phaseProfiler import PhaseProfiler
+from summaryTables import SummaryTables
+
 
 if __name__ == '__main__':
     attack_kind = 0
     dry_run = False
-    rand.seed(311)
+    root_seed = 311
     attack_start = 5
+    n_ticks = 100
+    n_workers = None  # all available cores
+    cache_path = 'cache'  # finished cells are stored here and skipped when the sweep is run again
+    store_path = f'results/atk{attack_kind}'  # binary result store of the sweep
+    export_csv = False  # additionally write the end/shares/status_result CSV files of the original layout
+    use_graph_bank = True  # all cells run their replicates on the same 100 networks (paired comparisons)
+    n_light = 1  # number of light (prebunking) agents per network, the most followed agents
+    n_dark = 1  # number of dark agents per network (coordinated campaign), agents at the dark quantile of the in-degree
+    adaptive = None  # e.g. dict(target_width=2.0): stop the replicates of a cell once the CIs are narrow enough
+    quantiles = ()  # e.g. (0.05, 0.95): bands over the replicates stored next to the means and standard deviations
+    common_random = False  # all cells share the random draws of their replicates (smooth curves with fewer replicates)
+    profile = False  # report the wall time and counters of every simulation phase summed over all computed cells
+    summary_path = '.'  # all_results_atk*.csv, filtered_df.csv and infected_views.csv are kept up to date here
     print('Start Simulation for attack kind:', attack_kind)
 
-    for prebunk in np.arange(0, 1.1, 0.1):
-        prob_prebunk = round(prebunk, 1)
-
-        for immune in np.arange(0, 1.1, 0.1):
-            prob_immune = round(immune, 1)
-
-            store_end_result = pd.DataFrame()
-            store_shares_result = pd.DataFrame()
-            store_status_result = pd.DataFrame()
-
-            for indifferent in np.arange(0, 1.1, 0.1):
-                prob_share_indifferent = round(indifferent, 1)
-                print('Prebunk:', prob_prebunk, 'Immune:', prob_immune, 'Indifferent:', prob_share_indifferent)
-                for disinfo in np.arange(0, 1.1, 0.1):
-                    prob_share_disinfo = round(disinfo, 1)
-                    print('Disinfo:', prob_share_disinfo)
-                    for facts in np.arange(0, 1.1, 0.1):
-                        prob_share_facts = round(facts, 1)
-
-                        end_result_s = []
-                        end_result_i = []
-                        end_result_r = []
-
-                        shares_result_s = []
-                        shares_result_i = []
-                        shares_result_r = []
-
-                        status_result_s = []
-                        status_result_i = []
-                        status_result_r = []
-                        status_result_ar = []
-                        status_result_ui = []
-
-                        formatted_attack_kind = str(attack_kind).replace('.', '_')
-                        formatted_prob_prebunk = str(prob_prebunk).replace('.', '_')
-                        formatted_prob_immune = str(prob_immune).replace('.', '_')
-
-                        # Start the model
-                        for _ in range(100):
-                            end_result, shares_result, status_result = run_model(
-                                pop_size=100,
-                                n_ticks=100,
-                                n_friends=5,
-                                n_add=5,
-                                prob_share_indifferent=prob_share_indifferent,
-                                prob_share_disinfo=prob_share_disinfo,
-                                prob_share_facts=prob_share_facts,
-
-                                attack_start=attack_start,
-                                attack_kind=attack_kind,
-                                dark_quantile=.75,
-
-                                prob_prebunk=prob_prebunk,
-                                prob_immune=prob_immune,
-                                draw=False,
-                                verbose=False,
-                                dry_run=dry_run,
-                                custom_title=f"Example model with attack scenario I, P(r)= {prob_prebunk} and P(v)= {prob_immune}",
-                                file_name='./figures/atk_1'
-                            )
-                            end_result_s.append(end_result.get('n_s'))
-                            end_result_i.append(end_result.get('n_i'))
-                            end_result_r.append(end_result.get('n_r'))
-
-                            shares_result_s.append(shares_result.get('s'))
-                            shares_result_i.append(shares_result.get('i'))
-                            shares_result_r.append(shares_result.get('r'))
-
-                            status_result_s.append(status_result.get('s'))
-                            status_result_i.append(status_result.get('i'))
-                            status_result_r.append(status_result.get('r'))
-                            status_result_ar.append(status_result.get('ar'))
-                            status_result_ui.append(status_result.get('ui'))
-
-                        # Store the results
-
-                        if not dry_run:
-                            end_result = pd.DataFrame(dict(
-                                attack_start=attack_start,
-                                attack_kind=attack_kind,
-                                prob_prebunk=prob_prebunk,
-                                prob_immune=prob_immune,
-                                prob_share_indifferent=prob_share_indifferent,
-                                prob_share_disinfo=prob_share_disinfo,
-                                prob_share_facts=prob_share_facts,
-                                s=np.mean(end_result_s, axis=0),
-                                i=np.mean(end_result_i, axis=0),
-                                r=np.mean(end_result_r, axis=0),
-                                s_shares=[np.mean(shares_result_s, axis=0)],
-                                i_shares=[np.mean(shares_result_i, axis=0)],
-                                r_shares=[np.mean(shares_result_r, axis=0)],
-                                s_status=[np.mean(status_result_s, axis=0)],
-                                i_status=[np.mean(status_result_i, axis=0)],
-                                r_status=[np.mean(status_result_r, axis=0)],
-                                ar_status=[np.mean(status_result_ar, axis=0)],
-                                ui_status=[np.mean(status_result_ui, axis=0)],
-                            ), index=[0])
-
-                            shares_result = pd.DataFrame(dict(
-                                attack_start=attack_start,
-                                attack_kind=attack_kind,
-                                prebunk_prob=prob_prebunk,
-                                prob_immune=prob_immune,
-                                prob_share_indifferent=prob_share_indifferent,
-                                prob_share_disinfo=prob_share_disinfo,
-                                prob_share_facts=prob_share_facts,
-                                s=np.mean(shares_result_s, axis=0),
-                                i=np.mean(shares_result_i, axis=0),
-                                r=np.mean(shares_result_r, axis=0)
-                            ))
-
-                            status_result = pd.DataFrame(dict(
-                                attack_start=attack_start,
-                                attack_kind=attack_kind,
-                                prebunk_prob=prob_prebunk,
-                                prob_immune=prob_immune,
-                                prob_share_indifferent=prob_share_indifferent,
-                                prob_share_disinfo=prob_share_disinfo,
-                                prob_share_facts=prob_share_facts,
-                                s=np.mean(status_result_s, axis=0),
-                                i=np.mean(status_result_i, axis=0),
-                                r=np.mean(status_result_r, axis=0),
-                                ar=np.mean(status_result_ar, axis=0),
-                                ui=np.mean(status_result_ui, axis=0),
-                            ))
-
-                            store_end_result = pd.concat([store_end_result, end_result])
-                            store_shares_result = pd.concat([store_shares_result, shares_result])
-                            store_status_result = pd.concat([store_status_result, status_result])
-
-            if not store_end_result.empty:
-                store_end_result.to_csv(
-                    f"end_result_atk{formatted_attack_kind}_pre{formatted_prob_prebunk}_imu{formatted_prob_immune}.csv",
-                    index=False)  # Saves file without the index column
-            if not store_shares_result.empty:
-                store_shares_result.to_csv(
-                    f"shares_result_atk{formatted_attack_kind}_pre{formatted_prob_prebunk}_imu{formatted_prob_immune}.csv",
-                    index=False)  # Saves file without the index column
-
-            if not store_status_result.empty:
-                store_status_result.to_csv(
-                    f"status_result_atk{formatted_attack_kind}_pre{formatted_prob_prebunk}_imu{formatted_prob_immune}.csv",
-                    index=False)  # Saves file without the index column
+    graph_bank = bank_path('graphs', 100, 100, 5, 5, .75, root_seed, n_light, n_dark) if use_graph_bank else None
+
+    # Every cell gets its own seed derived from its parameters, results do not depend on the number of workers
+    cells = sweep_cells(attack_kind=attack_kind, attack_start=attack_start, root_seed=root_seed,
+                        n_reps=100, pop_size=100, n_ticks=n_ticks, n_friends=5, n_add=5, dark_quantile=.75,
+                        n_light=n_light, n_dark=n_dark, graph_bank=graph_bank, adaptive=adaptive, quantiles=quantiles,
+                        common_random=common_random)
+
+    # A dry run only prints the parameters of the cells, nothing is generated or written
+    if dry_run:
+        for cell in cells:
+            run_model(**{key: value for key, value in cell.items()
+                         if key not in ('n_reps', 'seed', 'graph_bank', 'adaptive', 'quantiles')}, dry_run=True)
+        sys.exit()
+
+    # The networks only depend on the topology parameters, they are generated once and reused by every cell
+    if graph_bank is not None:
+        GraphBank.load_or_generate(graph_bank, n_graphs=100, pop_size=100, n_friends=5, n_add=5, dark_quantile=.75,
+                                   seed=root_seed, n_light=n_light, n_dark=n_dark)
+
+    store = ResultStore.open_or_create(store_path, {axis: PROB_VALUES for axis in SWEEP_AXES}, n_ticks,
+                                       attrs=sweep_attrs(cells[0]),
+                                       **store_metrics(adaptive is not None, quantiles))
+
+    # Cells are written into the store and the summary tables as they complete
+    summary = SummaryTables(summary_path)
+    profiler = PhaseProfiler() if profile else None
+    for n, (cell, result) in enumerate(run_sweep(cells, n_workers=n_workers, cache=ResultCache(cache_path),
+                                                 profiler=profiler)):
+        store.write(cell, cell_metrics(*result))
+        summary.update(cell, result[0])
+        if n % len(PROB_VALUES) ** 3 == len(PROB_VALUES) ** 3 - 1:
+            print('Prebunk:', cell['prob_prebunk'], 'Immune:', cell['prob_immune'])
+            store.flush()
+            summary.write()
+    store.flush()
+    summary.write()
+
+    if export_csv:
+        store.export_csv('.')
+
+    if profiler is not None:
+        print(profiler.report())
 
     print('Saving complete for attack kind:', attack_kind, '.')
 
@@ -0,0 +1,198 @@
+import numpy as np
+from attacks import ATTACK_SCHEDULES
+
+# Metric name of every per replicate result of run_replicates (return_tensors) in the result store
+RESULT_METRICS = dict(
+    end=dict(n_s='s', n_i='i', n_r='r'),
+    shares=dict(s='s_shares', i='i_shares', r='r_shares'),
+    status=dict(s='s_status', i='i_status', r='r_status', ar='ar_status', ui='ui_status'),
+)
+
+
+def quantile_suffix(q):
+    """
+    Metric name suffix of a quantile, e.g. 0.05 -> '_q05'
+    """
+    return f'_q{round(q * 100):02d}'
+
+
+class RunningStats:
+    """
+    Running mean and variance of a stream of equally shaped arrays (e.g. the time series of one metric of every
+    replicate) in fixed memory, updated with Welford's method (Chan et al. for whole batches and for merging). With
+    value_range set it also keeps a histogram per element from which approximate quantiles are read, the resolution is
+    one bin, values outside of the range are counted in the first or last bin.
+    count          number of arrays added
+    mean           running mean per element
+    """
+
+    def __init__(self, shape=(), value_range=None, n_bins=None):
+        """
+        shape: (tuple)
+            [()]: shape of every added array
+        value_range: (tuple)
+            [None]: (low, high) of the histogram, None to not track quantiles
+        n_bins: (int)
+            [None]: number of histogram bins, one per integer in the range by default
+        """
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+
+        self.value_range = value_range
+        self.histogram = None
+        if value_range is not None:
+            if n_bins is None:
+                n_bins = int(np.ceil(value_range[1] - value_range[0]))
+            self.histogram = np.zeros(self.shape + (n_bins,), dtype=np.int64)
+
+    def add(self, values):
+        """
+        Fold one array into the statistics (Welford)
+        """
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+        if self.histogram is not None:
+            self._bin(values[None])
+
+    def add_batch(self, values):
+        """
+        Fold a batch of arrays (first axis) into the statistics
+        """
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        mean = values.mean(axis=0)
+        self._combine(len(values), mean, ((values - mean) ** 2).sum(axis=0))
+        if self.histogram is not None:
+            self._bin(values)
+
+    def merge(self, other):
+        """
+        Fold the statistics of another accumulator (e.g. of a batch run by another worker) into this one
+        """
+        if other.shape != self.shape or other.value_range != self.value_range:
+            raise ValueError("Only statistics of the same shape and range can be merged.")
+        if other.count:
+            self._combine(other.count, other.mean, other._m2)
+            if self.histogram is not None:
+                self.histogram += other.histogram
+        return self
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self._m2 = self._m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def _bin(self, values):
+        low, high = self.value_range
+        n_bins = self.histogram.shape[-1]
+        bins = np.clip(((values - low) * n_bins / (high - low)).astype(np.int64), 0, n_bins - 1)
+        # Count the bin of every value per element: offset the bins of each element into one flat histogram
+        offsets = np.arange(int(np.prod(self.shape))).reshape(self.shape) * n_bins
+        self.histogram += np.bincount((bins + offsets).ravel(),
+                                      minlength=self.histogram.size).reshape(self.histogram.shape)
+
+    @property
+    def variance(self):
+        """
+        Sample variance per element (NaN for less than two arrays)
+        """
+        if self.count < 2:
+            return np.full(self.shape, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def quantile(self, q):
+        """
+        Approximate q-quantile per element, interpolated linearly within the histogram bin
+        """
+        if self.histogram is None:
+            raise ValueError("Quantiles are only tracked with a value_range.")
+        if not self.count:
+            return np.full(self.shape, np.nan)
+        low, high = self.value_range
+        n_bins = self.histogram.shape[-1]
+        cumulative = self.histogram.cumsum(axis=-1)
+        target = q * self.count
+        bins = np.argmax(cumulative >= max(target, 1), axis=-1)[..., None]
+        below = np.take_along_axis(cumulative, bins, axis=-1) - np.take_along_axis(self.histogram, bins, axis=-1)
+        fraction = (target - below) / np.take_along_axis(self.histogram, bins, axis=-1)
+        return (low + (bins + np.clip(fraction, 0, 1)) * (high - low) / n_bins)[..., 0]
+
+
+class ReplicateStats:
+    """
+    Running statistics of all results of a sweep cell over its replicates: one RunningStats per metric, filled with the
+    per replicate results of run_replicates, so batches of replicates can be folded in one after the other (or merged
+    from several workers) without keeping the replicates.
+    """
+
+    def __init__(self, pop_size, n_ticks, quantiles=(), n_dark=1):
+        """
+        pop_size: (int)
+            number of agents, bounds the histograms of the quantiles
+        n_ticks: (int)
+            length of the time series
+        quantiles: (tuple)
+            [()]: quantiles to report, e.g. (0.05, 0.95) for a 90 % band, none to only track mean and standard deviation
+        n_dark: (int)
+            [1]: number of dark agents, bounds the histograms of the shares
+        """
+        self.quantiles = tuple(quantiles)
+        self.stats = {}
+        # Every agent shares at most once per tick, a dark agent up to the highest frequency of the attack schedules
+        max_shares = pop_size + n_dark * (max(max(schedule) for schedule in ATTACK_SCHEDULES.values()) - 1)
+        for part, metrics in RESULT_METRICS.items():
+            for key, metric in metrics.items():
+                # Counts of agents lie in [0, pop_size], the shares in [0, max_shares]
+                high = max_shares if part == 'shares' else pop_size
+                self.stats[metric] = RunningStats(() if part == 'end' else (n_ticks,),
+                                                  (-.5, high + .5) if self.quantiles else None)
+
+    @property
+    def count(self):
+        return self.stats['s'].count
+
+    def add(self, tensors):
+        """
+        Fold the per replicate results (fourth return value of run_replicates with return_tensors) into the statistics
+        """
+        for part, metrics in RESULT_METRICS.items():
+            for key, metric in metrics.items():
+                self.stats[metric].add_batch(tensors[part][key])
+
+    def merge(self, other):
+        for metric, stats in self.stats.items():
+            stats.merge(other.stats[metric])
+        return self
+
+    def means(self):
+        """
+        Means over all replicates as the three result dicts of run_replicates
+        """
+        return tuple({key: self.stats[metric].mean for key, metric in metrics.items()}
+                     for metrics in RESULT_METRICS.values())
+
+    def std(self, metric):
+        return self.stats[metric].std
+
+    def dispersion(self):
+        """
+        Standard deviation and quantiles of every metric, named as in the result store (e.g. i_std, i_status_q95)
+        """
+        dispersion = {}
+        for metric, stats in self.stats.items():
+            dispersion[metric + '_std'] = stats.std
+            for q in self.quantiles:
+                dispersion[metric + quantile_suffix(q)] = stats.quantile(q)
+        return dispersion
@@ -0,0 +1,119 @@
+import numpy as np
+
+
+class OpinionHistory:
+    """
+    Recording policy for the opinions of all agents during a run, passed to run_model/run_replicates as history.
+    mode           'off', 'ring' or 'transitions'
+        'off':         nothing is recorded
+        'ring':        the opinions of all agents after each of the last 'size' ticks are kept (fixed memory)
+        'transitions': only the opinion changes are kept as (tick, agent, old, new), together with the initial opinions
+                       every past state can be reconstructed
+
+    The state after tick t is recorded as tick t, the initial state (before tick 0) as tick -1.
+    """
+
+    def __init__(self, mode='transitions', size=10):
+        """
+        mode: (str)
+            'off', 'ring' or ['transitions']
+        size: (int)
+            [10]: number of ticks kept by the ring buffer
+        """
+        if mode not in ('off', 'ring', 'transitions'):
+            raise ValueError(f"Unknown history mode: {mode}")
+        self.mode = mode
+        self.size = size
+
+        self.initial = None
+        self._last = None
+        self._ring = None
+        self._ring_ticks = None
+        self._transitions = []
+
+    def start(self, opinions):
+        """
+        Record the initial opinions of all agents
+        """
+        if self.mode == 'off':
+            return
+        opinions = np.array(opinions, dtype=np.int8)
+        self.initial = opinions.copy()
+        self._last = opinions
+        if self.mode == 'ring':
+            self._ring = np.zeros((self.size, len(opinions)), dtype=np.int8)
+            self._ring_ticks = np.full(self.size, -2)
+            self._store_ring(-1, opinions)
+
+    def record(self, tick, opinions):
+        """
+        Record the opinions of all agents after the given tick
+        """
+        if self.mode == 'ring':
+            self._store_ring(tick, opinions)
+        elif self.mode == 'transitions':
+            opinions = np.asarray(opinions, dtype=np.int8)
+            agents = np.flatnonzero(opinions != self._last)
+            if len(agents):
+                transitions = np.zeros(len(agents), dtype=[('tick', np.int32), ('agent', np.int64),
+                                                           ('old', np.int8), ('new', np.int8)])
+                transitions['tick'] = tick
+                transitions['agent'] = agents
+                transitions['old'] = self._last[agents]
+                transitions['new'] = opinions[agents]
+                self._transitions.append(transitions)
+                self._last = opinions.copy()
+
+    def record_constant(self, first, last, opinions):
+        """
+        Record opinions that stay the same after each of the ticks first to last, e.g. of a run that is fast-forwarded
+        from an absorbing state (the ring buffer only stores the ticks it keeps)
+        """
+        if self.mode == 'ring':
+            for tick in range(max(first, last - self.size + 1), last + 1):
+                self._store_ring(tick, opinions)
+        else:
+            self.record(first, opinions)
+
+    def _store_ring(self, tick, opinions):
+        slot = (tick + 1) % self.size
+        self._ring[slot] = opinions
+        self._ring_ticks[slot] = tick
+
+    def transitions(self):
+        """
+        All recorded opinion changes as structured array with the fields tick, agent, old and new
+        """
+        if self.mode != 'transitions':
+            raise ValueError("Transitions are only recorded in the 'transitions' mode.")
+        if not self._transitions:
+            return np.zeros(0, dtype=[('tick', np.int32), ('agent', np.int64), ('old', np.int8), ('new', np.int8)])
+        self._transitions = [np.concatenate(self._transitions)]
+        return self._transitions[0]
+
+    def opinions_at(self, tick):
+        """
+        Opinions of all agents after the given tick (-1 for the initial opinions)
+        """
+        if self.mode == 'ring':
+            slot = np.flatnonzero(self._ring_ticks == tick)
+            if not len(slot):
+                raise ValueError(f"Tick {tick} is no longer in the ring buffer.")
+            return self._ring[slot[0]].copy()
+        if self.mode == 'transitions':
+            opinions = self.initial.copy()
+            transitions = self.transitions()
+            applied = transitions[transitions['tick'] <= tick]
+            opinions[applied['agent']] = applied['new']
+            return opinions
+        raise ValueError("No history is recorded in the 'off' mode.")
+
+    def trajectory(self, agent, n_ticks):
+        """
+        Opinion of one agent initially and after each of the n_ticks ticks (only in the 'transitions' mode)
+        """
+        trajectory = np.full(n_ticks + 1, self.initial[agent], dtype=np.int8)
+        transitions = self.transitions()
+        for transition in transitions[transitions['agent'] == agent]:
+            trajectory[transition['tick'] + 1:] = transition['new']
+        return trajectory
@@ -0,0 +1,85 @@
+from time import perf_counter
+
+COUNTERS = ('agents', 'engagement', 'transitions')
+
+
+class PhaseProfiler:
+    """
+    Opt-in instrumentation of the simulation, passed to run_model/run_replicates/simulate as profiler. For every phase
+    (create_population, count, share, check_friends, update_opinion, fast_forward, ...) it sums up
+    calls          number of times the phase ran (ticks for the tick phases)
+    seconds        wall time
+    agents         agents evaluated
+    engagement     engagement items generated (share phase)
+    transitions    opinion changes (update_opinion phase)
+
+    The engines call lap(phase) at the end of every phase, the time since the previous lap (or start) is attributed
+    to it. Counters that need extra work are added with add() afterwards, the time spent counting is not attributed to
+    any phase. Without a profiler the engines only check for None once per phase.
+    Profilers of several runs, replicates or sweep cells (e.g. from worker processes) are combined with merge.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._clock = perf_counter()
+
+    def start(self):
+        """
+        Restart the clock, e.g. at the beginning of a run, the time before is not attributed to any phase
+        """
+        self._clock = perf_counter()
+
+    def _totals(self, phase):
+        totals = self.phases.get(phase)
+        if totals is None:
+            totals = self.phases[phase] = dict(calls=0, seconds=0., **dict.fromkeys(COUNTERS, 0))
+        return totals
+
+    def lap(self, phase, **counters):
+        """
+        Attribute the time since the last lap to phase and add the given counters (agents, engagement, transitions)
+        """
+        now = perf_counter()
+        totals = self._totals(phase)
+        totals['calls'] += 1
+        totals['seconds'] += now - self._clock
+        for counter, value in counters.items():
+            totals[counter] += int(value)
+        self._clock = perf_counter()
+
+    def add(self, phase, **counters):
+        """
+        Add counters to a phase without attributing time to it, the clock restarts afterwards
+        """
+        totals = self._totals(phase)
+        for counter, value in counters.items():
+            totals[counter] += int(value)
+        self._clock = perf_counter()
+
+    def merge(self, other):
+        """
+        Add the totals of another profiler to this one
+        """
+        for phase, other_totals in other.phases.items():
+            totals = self._totals(phase)
+            for key, value in other_totals.items():
+                totals[key] += value
+        return self
+
+    def summary(self):
+        """
+        Frame with one row per phase: the totals, the time per call and the share of the total time
+        """
+        import pandas as pd  # only needed for the report, not in the workers that collect the totals
+
+        frame = pd.DataFrame.from_dict(self.phases, orient='index', columns=['calls', 'seconds', *COUNTERS])
+        frame.index.name = 'phase'
+        frame['ms_per_call'] = 1000 * frame['seconds'] / frame['calls']
+        frame['time_share'] = frame['seconds'] / frame['seconds'].sum()
+        return frame.sort_values('seconds', ascending=False)
+
+    def report(self):
+        """
+        The summary as text table
+        """
+        return self.summary().to_string(float_format=lambda value: f'{value:.4g}')
@@ -1,47 +1,177 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import networkx as nx
+import numpy as np
 from matplotlib import pyplot as plt, gridspec as gridspec, lines as lines
+from matplotlib.collections import LineCollection
+from arrayModel import STATUS_CODES
+
+status_dict = {
+    "S": 'grey',
+    "R": 'lightgreen',
+    "aR": 'darkgreen',
+    "I": 'pink',
+    "uI": 'darkred'
+}
+node_mult = 25  # magnification factor of nodes in the plot
+# Networks with more nodes are laid out with sampled_spring_layout and drawn as collections without arrows and labels
+LARGE_NETWORK = 500
+
+# Layouts computed in this process, by topology
+_layouts = {}
 
 
 def draw_plot(node_list_start, tie_list_start, node_list_end, tie_list_end, e_s, e_i, e_r, n_s, n_i, n_r, n_ar, n_ui,
               custom_title, file_name):
-    node_mult = 25  # magnification factor of nodes in the plot
+    """
+    draw_network_plot for the node and tie lists of get_network
+    """
+    def state(node_list, tie_list):
+        ties = np.array(tie_list, dtype=np.int64).reshape(-1, 2)
+        ties = ties[np.argsort(ties[:, 0], kind='stable')]
+        indptr = np.zeros(len(node_list) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(ties[:, 0], minlength=len(node_list)))
+        status = np.array([STATUS_CODES.index(attributes['status']) for node, attributes in node_list], dtype=np.int8)
+        return indptr, ties[:, 1], status
+
+    draw_network_plot(state(node_list_start, tie_list_start), state(node_list_end, tie_list_end),
+                      e_s, e_i, e_r, n_s, n_i, n_r, n_ar, n_ui, custom_title, file_name)
+
+
+def network_state(population):
+    """
+    Adjacency and status of a population as arrays: (indptr, indices, status), the friends of agent a are
+    indices[indptr[a]:indptr[a + 1]], status holds indices into STATUS_CODES
+    """
+    indptr = np.zeros(len(population) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(agent.friends) for agent in population])
+    indices = np.fromiter((friend.node_id for agent in population for friend in agent.friends), dtype=np.int64,
+                          count=indptr[-1])
+    status = np.array([STATUS_CODES.index(agent.status) for agent in population], dtype=np.int8)
+    return indptr, indices, status
+
+
+def topology_key(indptr, indices):
+    """
+    Hash of an adjacency, networks with the same key share their layout
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(indptr, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def sampled_spring_layout(indptr, indices, iterations=50, n_samples=64, seed=None):
+    """
+    Force-directed layout for large networks: like the Fruchterman-Reingold layout of nx.spring_layout, but the
+    repulsion of every node is estimated from n_samples random nodes per iteration, so an iteration is linear in the
+    nodes and edges instead of quadratic
+    returns the positions (n, 2) in [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    n = len(indptr) - 1
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    pos = rng.random((n, 2))
+    k = 1 / np.sqrt(n)  # optimal distance
+    temperature = .1
+
+    for _ in range(iterations):
+        samples = rng.integers(0, n, n_samples)
+        delta = pos[:, None, :] - pos[samples][None, :, :]
+        distance = np.maximum(np.linalg.norm(delta, axis=2), 1e-3)
+        displacement = (delta * (k ** 2 / distance ** 2)[:, :, None]).sum(axis=1) * n / n_samples
+
+        edge_delta = pos[rows] - pos[indices]
+        edge_force = edge_delta * np.linalg.norm(edge_delta, axis=1)[:, None] / k
+        np.subtract.at(displacement, rows, edge_force)
+        np.add.at(displacement, indices, edge_force)
+
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        pos += displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature -= .1 / (iterations + 1)
 
-    start_network = nx.DiGraph()
-    start_network.add_nodes_from(node_list_start)
-    start_network.add_edges_from(tie_list_start)
+    pos -= pos.mean(axis=0)
+    return pos / np.abs(pos).max()
 
-    status_dict = {
-        "S": 'grey',
-        "R": 'lightgreen',
-        "aR": 'darkgreen',
-        "I": 'pink',
-        "uI": 'darkred'
-    }
 
-    colors = [status_dict[start_network.nodes[val]['status']] for val in start_network.nodes]
-    degrees = [val * node_mult for (node, val) in start_network.degree()]
+def network_layout(indptr, indices, cache_dir=None, seed=None):
+    """
+    Layout of a network (positions (n, 2)), computed once per topology and reused: from the layouts of this process
+    and, with cache_dir, from .npy files shared by all processes
+    """
+    key = topology_key(indptr, indices)
+    if key in _layouts:
+        return _layouts[key]
+    file_name = os.path.join(cache_dir, key + '.npy') if cache_dir is not None else None
+    if file_name is not None and os.path.exists(file_name):
+        _layouts[key] = np.load(file_name)
+        return _layouts[key]
 
-    lay = nx.spring_layout(start_network)  # , weight = 50)
+    n = len(indptr) - 1
+    if n > LARGE_NETWORK:
+        pos = sampled_spring_layout(indptr, indices, seed=seed)
+    else:
+        network = nx.DiGraph()
+        network.add_nodes_from(range(n))
+        network.add_edges_from(zip(np.repeat(np.arange(n), np.diff(indptr)).tolist(), np.asarray(indices).tolist()))
+        lay = nx.spring_layout(network, seed=seed)  # , weight = 50)
+        pos = np.array([lay[node] for node in range(n)])
+
+    if file_name is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_name = f'{file_name}.{os.getpid()}.tmp.npy'
+        np.save(tmp_name, pos)
+        os.replace(tmp_name, file_name)
+    _layouts[key] = pos
+    return pos
+
+
+def draw_network(ax, indptr, indices, status, pos):
+    """
+    Draw a network at the given positions: node size by degree (in and out), node color by status
+    """
+    n = len(indptr) - 1
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    degrees = (np.diff(indptr) + np.bincount(indices, minlength=n)) * node_mult
+    colors = [status_dict[STATUS_CODES[code]] for code in status]
+
+    if n > LARGE_NETWORK:
+        # Node sizes and edge opacity shrink with the network so the figure keeps its density
+        ax.add_collection(LineCollection(np.stack([pos[rows], pos[indices]], axis=1), colors='k', linewidths=.3,
+                                         alpha=.3 * LARGE_NETWORK / n))
+        ax.scatter(pos[:, 0], pos[:, 1], s=degrees * LARGE_NETWORK / n, c=colors, alpha=.75, linewidths=0)
+        ax.set_axis_off()
+        return
+
+    network = nx.DiGraph()
+    network.add_nodes_from(range(n))
+    network.add_edges_from(zip(rows.tolist(), np.asarray(indices).tolist()))
+    lay = dict(enumerate(pos))
+    nx.draw_networkx_nodes(network, pos=lay, ax=ax, node_size=degrees, node_color=colors, alpha=.75)
+    nx.draw_networkx_edges(network, pos=lay, arrows=True, ax=ax, node_size=degrees, alpha=.3)
+    nx.draw_networkx_labels(network, pos=lay, ax=ax, font_size=8)
+
+
+def draw_network_plot(start_state, end_state, e_s, e_i, e_r, n_s, n_i, n_r, n_ar, n_ui, custom_title, file_name,
+                      layout_cache=None):
+    """
+    Figure of a run: the network at the start and at the end (a, b), the shares (c) and the status counts (d)
+    start_state, end_state: (tuple)
+        (indptr, indices, status) of the network, see network_state
+    layout_cache: (str)
+        [None]: directory of layouts shared between processes, see network_layout
+    """
+    lay = network_layout(start_state[0], start_state[1], layout_cache)
     fig = plt.figure(figsize=(15, 15))
     gs = gridspec.GridSpec(3, 3, height_ratios=[1, .4, .4], width_ratios=[1, 1, .1])
 
     net_start = fig.add_subplot(gs[0])
-    nx.draw_networkx_nodes(start_network, pos=lay, ax=net_start, node_size=degrees, node_color=colors, alpha=.75)
-    nx.draw_networkx_edges(start_network, pos=lay, arrows=True, ax=net_start, node_size=degrees, alpha=.3)
-    nx.draw_networkx_labels(start_network, pos=lay, font_size=8)
+    draw_network(net_start, *start_state, lay)
     net_start.set_title('a)', loc='left')
 
-    end_network = nx.DiGraph()
-    end_network.add_nodes_from(node_list_end)
-    end_network.add_edges_from(tie_list_end)
-
-    colors = [status_dict[end_network.nodes[val]['status']] for val in end_network.nodes]
-    degrees = [val * node_mult for (node, val) in end_network.degree()]
-
     net_end = fig.add_subplot(gs[1])
-    nx.draw_networkx_nodes(end_network, pos=lay, ax=net_end, node_size=degrees, node_color=colors, alpha=.75)
-    nx.draw_networkx_edges(end_network, pos=lay, arrows=True, ax=net_end, node_size=degrees, alpha=.3)
-    nx.draw_networkx_labels(end_network, pos=lay, font_size=8)
+    draw_network(net_end, *end_state, lay)
     net_end.set_title('b)', loc='left')
 
     net_legend = fig.add_subplot(gs[2])
@@ -100,6 +230,27 @@ def draw_plot(node_list_start, tie_list_start, node_list_end, tie_list_end, e_s,
     fig.tight_layout()
 
     fig.savefig(file_name, dpi=300)
+    plt.close(fig)
+
+
+def render_plot(job):
+    return draw_network_plot(**job)
+
+
+def render_plots(jobs, n_workers=None):
+    """
+    Render many figures concurrently in worker processes
+    jobs: (list)
+        keyword arguments of draw_network_plot for every figure
+    n_workers: (int)
+        [None]: number of worker processes, all cores by default, 1 renders in this process
+    """
+    if n_workers == 1:
+        for job in jobs:
+            render_plot(job)
+        return
+    with ProcessPoolExecutor(n_workers, initializer=plt.switch_backend, initargs=('Agg',)) as executor:
+        list(executor.map(render_plot, jobs))
 
 
 def get_network(population):
@@ -0,0 +1,72 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Modules whose source determines the results of a sweep cell
+CODE_MODULES = ('Agent.py', 'arrayModel.py', 'attacks.py', 'commonRandom.py', 'friendGraph.py', 'graphBank.py',
+                'onlineStats.py', 'runModel.py', 'runSweep.py')
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of the source of the simulation modules, a change to any of them invalidates all cached results
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in CODE_MODULES:
+        with open(os.path.join(directory, module), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def cell_key(cell):
+    """
+    Content address of a sweep cell: hash of its full parameter set (including n_reps and seed) and the code version
+    """
+    content = json.dumps(dict(cell, code_version=code_version()), sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of sweep cell results, one pickle file per cell under path/<key[:2]>/<key>.pkl
+    """
+
+    def __init__(self, path='cache'):
+        """
+        path: (str)
+            ['cache']: directory the results are stored in
+        """
+        self.path = path
+
+    def file_name(self, cell):
+        key = cell_key(cell)
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def __contains__(self, cell):
+        return os.path.exists(self.file_name(cell))
+
+    def get(self, cell):
+        """
+        Cached result of the cell or None if it has not been computed yet
+        """
+        try:
+            with open(self.file_name(cell), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, cell, result):
+        """
+        Store the result of the cell, the file is written atomically so an interrupted write never leaves a broken entry
+        """
+        file_name = self.file_name(cell)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(result, file)
+        os.replace(tmp_name, file_name)
@@ -0,0 +1,287 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from onlineStats import quantile_suffix
+
+# Metrics with one value per sweep cell and metrics with one value per cell and tick
+SCALAR_METRICS = ('s', 'i', 'r')
+SERIES_METRICS = ('s_shares', 'i_shares', 'r_shares', 's_status', 'i_status', 'r_status', 'ar_status', 'ui_status')
+# Additional scalar metrics of adaptive sweeps: achieved number of replicates and confidence interval widths
+ADAPTIVE_METRICS = ('n_reps', 'ci_width_i', 'ci_width_r')
+
+
+def store_metrics(adaptive=False, quantiles=()):
+    """
+    Scalar and time series metrics of a sweep store: the means, the standard deviations over the replicates (e.g.
+    i_std) and the given quantiles (e.g. i_q05), plus the ADAPTIVE_METRICS for adaptive sweeps
+    returns dict(scalar_metrics=..., series_metrics=...) for ResultStore.create
+    """
+    suffixes = ['_std'] + [quantile_suffix(q) for q in quantiles]
+    scalar_metrics = SCALAR_METRICS + tuple(metric + suffix for suffix in suffixes for metric in SCALAR_METRICS)
+    series_metrics = SERIES_METRICS + tuple(metric + suffix for suffix in suffixes for metric in SERIES_METRICS)
+    if adaptive:
+        scalar_metrics += ADAPTIVE_METRICS
+    return dict(scalar_metrics=scalar_metrics, series_metrics=series_metrics)
+
+
+def cell_metrics(end_result, shares_result, status_result, dispersion=None):
+    """
+    Map the three result dicts of run_model/run_replicates (and the dispersion of a sweep cell, see
+    runSweep.run_cell) onto the metric names of the store
+    """
+    metrics = dict(
+        s=end_result.get('n_s'),
+        i=end_result.get('n_i'),
+        r=end_result.get('n_r'),
+        s_shares=shares_result.get('s'),
+        i_shares=shares_result.get('i'),
+        r_shares=shares_result.get('r'),
+        s_status=status_result.get('s'),
+        i_status=status_result.get('i'),
+        r_status=status_result.get('r'),
+        ar_status=status_result.get('ar'),
+        ui_status=status_result.get('ui'),
+    )
+    metrics.update({metric: end_result[metric] for metric in ADAPTIVE_METRICS if metric in end_result})
+    metrics.update(dispersion or {})
+    return metrics
+
+
+def json_attrs(attrs):
+    """
+    attrs as they read back from meta.json (e.g. tuples become lists), so they can be compared with stored ones
+    """
+    return json.loads(json.dumps(attrs or {}))
+
+
+class ResultStore:
+    """
+    Binary store of the results of one sweep: a dense array per metric with one axis per swept parameter (and a tick
+    axis for time series), every array is a .npy file in the store directory that is opened memory-mapped, so reading
+    a slice only touches the bytes of that slice. meta.json holds the axes and the fixed parameters of the sweep,
+    done.npy marks the cells that have been written.
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        Open an existing store
+        path: (str)
+            directory of the store
+        mode: (str)
+            ['r']: read only, 'r+': the results can be written
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+
+        self.axes = {name: np.array(values) for name, values in self.meta['axes'].items()}
+        self.n_ticks = self.meta['n_ticks']
+        self.scalar_metrics = tuple(self.meta['scalar_metrics'])
+        self.series_metrics = tuple(self.meta['series_metrics'])
+        self.done = np.load(os.path.join(path, 'done.npy'), mmap_mode=mode)
+        self.data = {metric: np.load(os.path.join(path, metric + '.npy'), mmap_mode=mode)
+                     for metric in self.scalar_metrics + self.series_metrics}
+        self._positions = {name: {round(float(value), 6): i for i, value in enumerate(values)}
+                           for name, values in self.axes.items()}
+
+    @classmethod
+    def create(cls, path, axes, n_ticks, attrs=None, scalar_metrics=SCALAR_METRICS, series_metrics=SERIES_METRICS,
+               sparse=False):
+        """
+        Create an empty store (all results NaN) and open it for writing
+        axes: (dict)
+            name of every swept parameter mapped to its values, in the nesting order of the sweep
+        n_ticks: (int)
+            length of the time series
+        attrs: (dict)
+            [None]: fixed parameters of the sweep (see runSweep.sweep_attrs), stored as JSON
+        sparse: (bool)
+            [False]: do not fill the arrays with NaN, the files then stay sparse on disk until cells are written (for
+            fine grids of which only a part is computed), only cells marked in done hold results
+        """
+        os.makedirs(path, exist_ok=True)
+        shape = tuple(len(values) for values in axes.values())
+
+        for metric, metric_shape in [(metric, shape) for metric in scalar_metrics] + \
+                                    [(metric, shape + (n_ticks,)) for metric in series_metrics]:
+            array = np.lib.format.open_memmap(os.path.join(path, metric + '.npy'), mode='w+', dtype=float,
+                                              shape=metric_shape)
+            if not sparse:
+                array[...] = np.nan
+        # A new memmap is zero (False) already
+        np.lib.format.open_memmap(os.path.join(path, 'done.npy'), mode='w+', dtype=bool, shape=shape)
+
+        meta = dict(
+            axes={name: [float(value) for value in values] for name, values in axes.items()},
+            n_ticks=n_ticks,
+            attrs=json_attrs(attrs),
+            scalar_metrics=list(scalar_metrics),
+            series_metrics=list(series_metrics),
+        )
+        # meta.json is written last, a store without it is incomplete
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=1)
+
+        return cls(path, mode='r+')
+
+    @classmethod
+    def open_or_create(cls, path, axes, n_ticks, attrs=None, **kwargs):
+        """
+        Open the store for writing if it exists with the same axes, metrics and attrs (every fixed parameter of the
+        sweep), otherwise create it. A store of a different sweep raises ValueError, its finished cells are not mixed
+        with the new ones.
+        """
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            store = cls(path, mode='r+')
+            same_axes = {name: list(values) for name, values in store.meta['axes'].items()} == \
+                        {name: [float(value) for value in values] for name, values in axes.items()}
+            same_metrics = all(tuple(kwargs.get(key, default)) == getattr(store, key) for key, default in
+                               (('scalar_metrics', SCALAR_METRICS), ('series_metrics', SERIES_METRICS)))
+            attrs = json_attrs(attrs)
+            changed = sorted(key for key in set(attrs) | set(store.attrs) if attrs.get(key) != store.attrs.get(key))
+            if not same_axes or not same_metrics or store.n_ticks != n_ticks or changed:
+                raise ValueError(f"Store at {path} was created for a different sweep"
+                                 + (f" (parameters {', '.join(changed)} differ)." if changed else "."))
+            return store
+        return cls.create(path, axes, n_ticks, attrs, **kwargs)
+
+    @property
+    def attrs(self):
+        return self.meta['attrs']
+
+    def position(self, name, value):
+        """
+        Position of a parameter value on its axis
+        """
+        try:
+            return self._positions[name][round(float(value), 6)]
+        except KeyError:
+            raise ValueError(f"{name}={value} is not on the axes of the store.") from None
+
+    def index(self, **params):
+        """
+        Index of the cell with the given parameter values (missing parameters select the whole axis)
+        """
+        return tuple(self.position(name, params[name]) if name in params else slice(None) for name in self.axes)
+
+    def write(self, cell, metrics):
+        """
+        Write the metrics of one cell, cell holds the values of the swept parameters
+        """
+        idx = self.index(**{name: cell[name] for name in self.axes})
+        for metric, value in metrics.items():
+            self.data[metric][idx] = value
+        self.done[idx] = True
+
+    def flush(self):
+        for array in list(self.data.values()) + [self.done]:
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def cells(self):
+        """
+        Parameter values of all written cells in the nesting order of the sweep
+        """
+        for idx in zip(*np.nonzero(self.done)):
+            yield idx, {name: float(self.axes[name][i]) for name, i in zip(self.axes, idx)}
+
+    def export_csv(self, directory='.'):
+        """
+        Write the end, shares and status result files in the CSV layout of the original sweep, one set of files per
+        combination of the first two axes (prebunk and immune probability)
+        """
+        attack_kind = self.attrs.get('attack_kind')
+        attack_start = self.attrs.get('attack_start')
+        names = list(self.axes)
+
+        for i, j in np.ndindex(*self.done.shape[:2]):
+            indices = [(i, j) + tuple(rest) for rest in np.argwhere(self.done[i, j])]
+            if not indices:
+                continue
+
+            frames = [result_frames(attack_start, attack_kind,
+                                    {name: float(self.axes[name][k]) for name, k in zip(names, idx)},
+                                    {metric: np.array(self.data[metric][idx]) for metric in self.data})
+                      for idx in indices]
+
+            formatted_attack_kind = str(attack_kind).replace('.', '_')
+            formatted_prob_prebunk = str(round(float(self.axes[names[0]][i]), 1)).replace('.', '_')
+            formatted_prob_immune = str(round(float(self.axes[names[1]][j]), 1)).replace('.', '_')
+            suffix = f"atk{formatted_attack_kind}_pre{formatted_prob_prebunk}_imu{formatted_prob_immune}.csv"
+
+            for k, prefix in enumerate(('end_result', 'shares_result', 'status_result')):
+                pd.concat([frame[k] for frame in frames]).to_csv(
+                    os.path.join(directory, f"{prefix}_{suffix}"), index=False)  # Saves file without the index column
+
+
+def result_frames(attack_start, attack_kind, cell, metrics):
+    """
+    Turn the metrics of one sweep cell into the rows of the end, shares and status result CSV files, the dispersion
+    over the replicates (if stored) is added as further columns, e.g. i_std in the end result and i_std in the shares
+    result for the metric i_shares_std
+    """
+    end_extra, shares_extra, status_extra = {}, {}, {}
+    for metric, value in metrics.items():
+        if metric in SCALAR_METRICS + SERIES_METRICS + ADAPTIVE_METRICS:
+            continue
+        end_extra[metric] = [value] if np.ndim(value) else value
+        base, statistic = metric.rsplit('_', 1)
+        if base in SERIES_METRICS:
+            key, part = base.split('_')
+            (shares_extra if part == 'shares' else status_extra)[f'{key}_{statistic}'] = value
+
+    end_frame = pd.DataFrame(dict(
+        attack_start=attack_start,
+        attack_kind=attack_kind,
+        prob_prebunk=cell['prob_prebunk'],
+        prob_immune=cell['prob_immune'],
+        prob_share_indifferent=cell['prob_share_indifferent'],
+        prob_share_disinfo=cell['prob_share_disinfo'],
+        prob_share_facts=cell['prob_share_facts'],
+        s=metrics['s'],
+        i=metrics['i'],
+        r=metrics['r'],
+        s_shares=[metrics['s_shares']],
+        i_shares=[metrics['i_shares']],
+        r_shares=[metrics['r_shares']],
+        s_status=[metrics['s_status']],
+        i_status=[metrics['i_status']],
+        r_status=[metrics['r_status']],
+        ar_status=[metrics['ar_status']],
+        ui_status=[metrics['ui_status']],
+        **end_extra
+    ), index=[0])
+
+    shares_frame = pd.DataFrame(dict(
+        attack_start=attack_start,
+        attack_kind=attack_kind,
+        prebunk_prob=cell['prob_prebunk'],
+        prob_immune=cell['prob_immune'],
+        prob_share_indifferent=cell['prob_share_indifferent'],
+        prob_share_disinfo=cell['prob_share_disinfo'],
+        prob_share_facts=cell['prob_share_facts'],
+        s=metrics['s_shares'],
+        i=metrics['i_shares'],
+        r=metrics['r_shares'],
+        **shares_extra
+    ))
+
+    status_frame = pd.DataFrame(dict(
+        attack_start=attack_start,
+        attack_kind=attack_kind,
+        prebunk_prob=cell['prob_prebunk'],
+        prob_immune=cell['prob_immune'],
+        prob_share_indifferent=cell['prob_share_indifferent'],
+        prob_share_disinfo=cell['prob_share_disinfo'],
+        prob_share_facts=cell['prob_share_facts'],
+        s=metrics['s_status'],
+        i=metrics['i_status'],
+        r=metrics['r_status'],
+        ar=metrics['ar_status'],
+        ui=metrics['ui_status'],
+        **status_extra
+    ))
+
+    return end_frame, shares_frame, status_frame
@@ -1,50 +1,47 @@
 import random as rand
 import numpy as np
-from collections import Counter
+from collections import Counter, namedtuple
 import Agent
-from plotResults import draw_plot, get_network
+import arrayModel
+import largeGraph
+from friendGraph import friend_graph
+from frontier import ActiveFrontier
+from commonRandom import CommonRandom, SHARE, PREBUNK, IMMUNIZE
+from attacks import attack_schedule
 
+# Counts of one tick of a run, taken at the start of the tick: shares per opinion (no opinion, disinformation, fact
+# checking) and number of agents per status
+TickRecord = namedtuple('TickRecord', ['tick', 'e_s', 'e_i', 'e_r', 'n_s', 'n_i', 'n_r', 'n_ar', 'n_ui'])
 
-def create_population(verbose, pop_size, prob_share_indifferent, prob_prebunk, prob_immune, n_friends, n_add, dark_quantile):
+
+def create_population(verbose, pop_size, prob_share_indifferent, prob_prebunk, prob_immune, n_friends, n_add, dark_quantile,
+                      rng=rand, graph=None, n_light=1, n_dark=1):
 
     if verbose:
         print('Initializing population...')
 
     population = []
     for i in range(pop_size):
-        agent = Agent.Agent(prob_prebunk, i, prob_share_indifferent, prob_immune)
+        agent = Agent.Agent(prob_prebunk, i, prob_share_indifferent, prob_immune, rng=rng)
         population.append(agent)
 
-    chosen = population.copy()  # Helper List for already chosen Agents as friends;at the beginning every Agent exists
-    # exactly one time in the chosen-list
-
     if verbose:
         print('initializing friends')
-
-    for i in range(n_friends):
-        for agent in population:
-            n_friends = i + 1
-            while len(agent.friends) < n_friends:
-                fr = rand.choice(chosen)
-                if fr != agent and fr not in agent.friends:
-                    agent.friends.append(fr)
-                    # If an agent is chosen as a friend, the agent is added 5 more times to the chosen-list
-                    # (because of 'preferential attachment'):
-                    chosen.extend([fr] * n_add)
+    # Preferential attachment graph and light/dark choice, see friendGraph.friend_graph, unless a graph is given
+    if graph is None:
+        indptr, indices, in_degree, light, dark = friend_graph(pop_size, n_friends, n_add, dark_quantile, rng,
+                                                               n_light, n_dark)
+    else:
+        indptr, indices, light, dark = graph
+    for agent in population:
+        agent.friends = [population[fr] for fr in indices[indptr[agent.node_id]:indptr[agent.node_id + 1]].tolist()]
 
     if verbose:
         print('initializing light and dark')
-    light = Counter(chosen).most_common(1)[0][0]
-
-    incoming_edges = Counter(chosen)
-    n_list = list(incoming_edges.values())
-    med_in = np.quantile(n_list, dark_quantile, method='nearest')
-    m_list = [c for c, v in incoming_edges.items() if v == med_in]
-
-    dark = rand.choice(m_list)  # choose an Agent as dark Agent from the List of agents within the 0.75 quantile
-
-    light.alter_agent('light')
-    dark.alter_agent('dark')
+    for agent_id in np.atleast_1d(light).tolist():
+        population[agent_id].alter_agent('light')
+    for agent_id in np.atleast_1d(dark).tolist():
+        population[agent_id].alter_agent('dark')
 
     return population
 
@@ -56,8 +53,8 @@ def get_opinion_shares_and_agent_proportion(population):
 
     # Iterate to count opinions and clear engagements
     for agent in population:
-        engagement_counts[agent.opinion] += len(agent.engagement)
-        agent.engagement = []  # Clear engagement after counting
+        engagement_counts[agent.opinion] += agent.engagement
+        agent.engagement = 0  # Clear engagement after counting
 
     # Extract counts for statuses
     ns = status_counts["S"]
@@ -79,6 +76,208 @@ def get_opinion_shares_and_agent_proportion(population):
     return es, ei, er, ns, ni, nr, nar, nui
 
 
+def is_absorbing(population):
+    """
+    Can no agent of the population change its status anymore? True when no susceptible agent has a friend that may
+    share disinformation, or fact checking while the agent can still be immunized (e.g. when every regular agent is
+    resistant). Same rule as arrayModel.is_absorbing.
+    """
+    for agent in population:
+        if agent.resistance:
+            continue
+        for friend in agent.friends:
+            if friend.prob_share_opinion > 0 and (
+                    friend.opinion == 1 or (friend.opinion == 2 and agent.prob_prebunk > 0)):
+                return False
+    return True
+
+
+def iter_population(population, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts, attack_start,
+                    attack_kind, rng, history=None, fast_forward=False, scheduler='sweep', profiler=None, common=None):
+    """
+    Run the object engine on a population of Agent objects tick by tick, the parameters are the ones of run_model
+    (common is a commonRandom.CommonRandom)
+    yields a TickRecord per tick, the next tick is only stepped when the next record is requested
+    """
+    if scheduler not in ('sweep', 'frontier'):
+        raise ValueError(f"Unknown scheduler: {scheduler}")
+    frontier = ActiveFrontier(population) if scheduler == 'frontier' else None
+
+    schedule = attack_schedule(attack_kind, attack_start, n_ticks)
+    frequencies = schedule.tolist()
+    if history is not None:
+        history.start([agent.opinion for agent in population])
+
+    for tick in range(n_ticks):
+        if frontier is not None:
+            counts = frontier.count()
+        else:
+            counts = get_opinion_shares_and_agent_proportion(population)
+        if profiler is not None:
+            profiler.lap('count', agents=len(frontier.engaged) if frontier is not None else len(population))
+
+        if fast_forward and (frontier.is_absorbing() if frontier is not None else is_absorbing(population)):
+            pop = arrayModel.ArrayPopulation.from_populations([population])
+            shares = np.zeros((1, n_ticks, 3), dtype=np.int64)
+            status = np.zeros((1, n_ticks, len(arrayModel.STATUS_CODES)), dtype=np.int64)
+            shares[0, tick] = counts[:3]
+            status[0, tick] = counts[3:]
+            arrayModel.fast_forward(pop, np.random.default_rng(rng.getrandbits(64)), shares, status, tick, schedule)
+            if history is not None:
+                history.record_constant(tick, n_ticks - 1, [agent.opinion for agent in population])
+            if profiler is not None:
+                profiler.lap('fast_forward', agents=len(population))
+            for t in range(tick, n_ticks):
+                yield TickRecord(t, *shares[0, t].tolist(), *status[0, t].tolist())
+            return
+
+        yield TickRecord(tick, *counts)
+
+        uniforms = common.draw().tolist() if common is not None else None
+        frequency = frequencies[tick]
+        if frontier is not None:
+            frontier.step(frequency, prob_share_indifferent, prob_share_disinfo, prob_share_facts, profiler, uniforms)
+        else:
+            for agent in population:
+                u = None if uniforms is None else uniforms[SHARE][agent.node_id]
+                if agent.dark:
+                    agent.attack(frequency, u)
+                else:
+                    agent.share(u)
+            if profiler is not None:
+                profiler.lap('share', agents=len(population))
+                profiler.add('share', engagement=sum(agent.engagement for agent in population))
+
+            for agent in population:
+                if uniforms is None:
+                    agent.check_friends()
+                else:
+                    agent.check_friends(uniforms[PREBUNK][agent.node_id], uniforms[IMMUNIZE][agent.node_id])
+            if profiler is not None:
+                profiler.lap('check_friends', agents=len(population))
+                opinions = [agent.opinion for agent in population]
+                profiler.start()
+
+            for agent in population:
+                agent.update_opinion(prob_share_indifferent, prob_share_disinfo, prob_share_facts)
+            if profiler is not None:
+                profiler.lap('update_opinion', agents=len(population))
+                profiler.add('update_opinion', transitions=sum(agent.opinion != opinion
+                                                               for agent, opinion in zip(population, opinions)))
+
+        if history is not None:
+            history.record(tick, [agent.opinion for agent in population])
+            if profiler is not None:
+                profiler.lap('history')
+
+
+def iter_model(
+        pop_size,
+        n_ticks,
+        n_friends,
+        n_add,
+        prob_share_indifferent,
+        prob_share_disinfo,
+        prob_share_facts,
+
+        attack_start,
+        attack_kind,
+        dark_quantile,
+
+        prob_prebunk,
+        prob_immune,
+
+        verbose=False,
+        engine='object',
+        rng=rand,
+        graph=None,
+        history=None,
+        fast_forward=False,
+        scheduler='sweep',
+        profiler=None,
+        memory_limit=None,
+        common_seed=None,
+        stop=None,
+        population=None,
+        n_light=1,
+        n_dark=1
+):
+    """
+    Simulate the user network tick by tick, e.g. to stream the results to disk or a dashboard while the run goes on.
+    The parameters are the ones of run_model, additionally
+    population: (list)
+        [None]: population of Agent objects to run on instead of creating one (object and numpy engine), it holds the
+        final state of the run once the stream is exhausted, stopped or closed
+    yields a TickRecord per tick with the counts at the start of the tick, the next tick is only simulated when the
+    next record is requested. Nothing but the current state is kept, a caller can stop at any tick.
+    """
+    if profiler is not None:
+        profiler.start()
+    common = CommonRandom(common_seed, pop_size) if common_seed is not None else None
+    if engine == 'large':
+        if common is not None:
+            raise ValueError("The 'large' engine does not support common random numbers.")
+        if graph is None:
+            graph = largeGraph.LargeGraph.generate(pop_size, n_friends, n_add, dark_quantile, rng, n_light, n_dark)
+        elif not isinstance(graph, largeGraph.LargeGraph):
+            graph = largeGraph.LargeGraph.from_csr(*graph)
+    elif population is None:
+        if verbose:
+            print('create population')
+        population = create_population(verbose, pop_size,
+                                       prob_share_indifferent,
+                                       prob_prebunk, prob_immune,
+                                       n_friends,
+                                       n_add,
+                                       dark_quantile,
+                                       rng,
+                                       graph,
+                                       n_light,
+                                       n_dark)
+        if profiler is not None:
+            profiler.lap('create_population', agents=pop_size)
+
+    if verbose:
+        print('run model')
+
+    if engine == 'numpy':
+        pop = arrayModel.ArrayPopulation.from_populations([population])
+        ticks = (TickRecord(tick, *shares[0].tolist(), *status[0].tolist())
+                 for tick, shares, status in arrayModel.iter_simulate(pop, n_ticks,
+                                                                      prob_share_indifferent, prob_share_disinfo,
+                                                                      prob_share_facts, attack_start, attack_kind,
+                                                                      np.random.default_rng(rng.getrandbits(64)),
+                                                                      history, fast_forward, profiler, common))
+    elif engine == 'large':
+        chunk_size = largeGraph.CHUNK_SIZE
+        if memory_limit is not None:
+            chunk_size = largeGraph.fit_chunk_size(graph, memory_limit, chunk_size)
+        if verbose:
+            memory = largeGraph.estimate_memory(graph.pop_size, graph.n_edges, chunk_size, graph.mapped)
+            print('memory (MiB):', {part: round(value / 2 ** 20, 1) for part, value in memory.items()})
+        ticks = (TickRecord(tick, *shares.tolist(), *status.tolist())
+                 for tick, shares, status in largeGraph.iter_simulate(graph, n_ticks,
+                                                                      prob_share_indifferent, prob_share_disinfo,
+                                                                      prob_share_facts, attack_start, attack_kind,
+                                                                      prob_prebunk, prob_immune,
+                                                                      np.random.default_rng(rng.getrandbits(64)),
+                                                                      chunk_size, history, profiler))
+    elif engine == 'object':
+        ticks = iter_population(population, n_ticks, prob_share_indifferent, prob_share_disinfo, prob_share_facts,
+                                attack_start, attack_kind, rng, history, fast_forward, scheduler, profiler, common)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    try:
+        for record in ticks:
+            yield record
+            if stop is not None and stop(record):
+                break
+    finally:
+        if engine == 'numpy':
+            pop.write_back([population])
+
+
 def run_model(
         pop_size,
         n_ticks,
@@ -99,7 +298,19 @@ def run_model(
         verbose=False,
         dry_run=False,
         custom_title='Title',
-        file_name='savefig'
+        file_name='savefig',
+        engine='object',
+        rng=rand,
+        graph=None,
+        history=None,
+        fast_forward=False,
+        scheduler='sweep',
+        profiler=None,
+        memory_limit=None,
+        common_seed=None,
+        stop=None,
+        n_light=1,
+        n_dark=1
 ):
     """
     Simulate the user network with the defined properties
@@ -122,7 +333,8 @@ def run_model(
     attack_start: (int)
         time step when the attacks start
     attack_kind: (int)
-        type of attack executed by the dark agents, i.e., which kind of stereotype is used as blueprint
+        type of attack executed by the dark agents, i.e., which kind of stereotype is used as blueprint (a key of
+        attacks.ATTACK_SCHEDULES)
     dark_quantile: (float)
         percentile of in-degrees of edges that determines which node is the dark agent
     prob_prebunk: (float)
@@ -139,6 +351,39 @@ def run_model(
         the title of the plot
     file_name: (str)
         the name of the file the plot is stored into
+    engine: (str)
+        ['object']: simulate every Agent object in Python loops
+        'numpy': simulate the population as arrays with vectorized phases (same statistics)
+        'large': simulate without Agent objects on an int32 CSR graph in chunks of agents with bounded memory, for
+        populations of millions of agents (same statistics, see largeGraph, no drawing and no fast-forward)
+    rng: (random.Random)
+        [random]: source of all random draws of the run, pass a seeded random.Random for reproducible runs
+    graph: (tuple)
+        [None]: friend graph (indptr, indices, light, dark) to use instead of a new one, e.g. GraphBank.graph(i), the
+        'large' engine also takes a largeGraph.LargeGraph (e.g. opened memory-mapped with LargeGraph.load)
+    history: (opinionHistory.OpinionHistory)
+        [None]: recording policy for the opinions of the agents, nothing is recorded by default
+    fast_forward: (bool)
+        [False]: stop stepping once no status can change anymore, the remaining status counts are then constant and
+        the remaining shares are drawn in bulk from the fixed sharing probabilities (same statistics)
+    scheduler: (str)
+        ['sweep']: the object engine visits every agent in every phase
+        'frontier': the object engine only visits sharing agents and the susceptible agents with a friend that shared
+        disinformation or fact checking (see frontier.ActiveFrontier, same statistics)
+    profiler: (phaseProfiler.PhaseProfiler)
+        [None]: records the wall time and counters of every phase of the run
+    memory_limit: (int)
+        [None]: maximum resident bytes of a run of the 'large' engine, see largeGraph.simulate
+    common_seed: (int)
+        [None]: draw the share, prebunk and immunize decisions from the common random numbers of this seed (replicate
+        0, see commonRandom.CommonRandom) instead of rng, runs with different parameters then face the same draws
+    stop: (callable)
+        [None]: called with the TickRecord of every tick, the run ends after the first tick it returns True for (e.g.
+        once the infection passes a threshold), the series then end at that tick
+    n_light, n_dark: (int)
+        [1]: number of light (prebunking) and dark agents, chosen by their in-degree like the single ones (see
+        friendGraph.light_and_dark), every dark agent attacks with the schedule of attack_kind (see attacks)
+    Use iter_model to process the ticks as they are simulated instead of collecting the full series.
     """
     if dry_run:
         print('Dry run with: ', 'Size: ', pop_size, 'Ticks: ', n_ticks,
@@ -149,58 +394,32 @@ def run_model(
               'Prob imu: ', prob_immune)
         return {}, {}, {}
 
-    if verbose:
-        print('create population')
-    population = create_population(verbose, pop_size,
-                                   prob_share_indifferent,
-                                   prob_prebunk, prob_immune,
-                                   n_friends,
-                                   n_add,
-                                   dark_quantile)
+    population = None
     if draw:
-        start_node_list, start_tie_list = get_network(population)
-
-    e_s = []
-    e_i = []
-    e_r = []
-    n_s = []
-    n_i = []
-    n_r = []
-    n_ar = []
-    n_ui = []
-
-    if verbose:
-        print('run model')
-
-    for tick in range(n_ticks):
-        es, ei, er, ns, ni, nr, nar, nui = get_opinion_shares_and_agent_proportion(population)
-        e_s.append(es)
-        e_i.append(ei)
-        e_r.append(er)
-        n_s.append(ns)
-        n_i.append(ni)
-        n_r.append(nr)
-        n_ar.append(nar)
-        n_ui.append(nui)
-
-        for agent in population:
-            if agent.dark:
-                agent.attack(tick, attack_kind, attack_start)
-            else:
-                agent.share()
-
-        for agent in population:
-            agent.check_friends()
-
-        for agent in population:
-            agent.update_opinion(prob_share_indifferent, prob_share_disinfo, prob_share_facts)
+        if engine == 'large':
+            raise ValueError("The 'large' engine keeps no Agent objects, the network cannot be drawn.")
+        # The plotting stack (matplotlib, networkx) is only imported by runs that draw
+        from plotResults import draw_network_plot, network_state
+        population = create_population(verbose, pop_size, prob_share_indifferent, prob_prebunk, prob_immune,
+                                       n_friends, n_add, dark_quantile, rng, graph, n_light, n_dark)
+        start_state = network_state(population)
+
+    records = list(iter_model(pop_size, n_ticks, n_friends, n_add,
+                              prob_share_indifferent, prob_share_disinfo, prob_share_facts,
+                              attack_start, attack_kind, dark_quantile, prob_prebunk, prob_immune,
+                              verbose=verbose, engine=engine, rng=rng, graph=graph, history=history,
+                              fast_forward=fast_forward, scheduler=scheduler, profiler=profiler,
+                              memory_limit=memory_limit, common_seed=common_seed, stop=stop, population=population,
+                              n_light=n_light, n_dark=n_dark))
+    _, e_s, e_i, e_r, n_s, n_i, n_r, n_ar, n_ui = map(list, zip(*records))
 
     if draw:
-        end_node_list, end_tie_list = get_network(population)
+        end_state = network_state(population)
         if verbose:
             print('draw plot')
-        draw_plot(start_node_list, start_tie_list, end_node_list, end_tie_list, e_s, e_i, e_r, n_s, n_i, n_r, n_ar,
-                  n_ui, custom_title, file_name)
+        draw_network_plot(start_state, end_state, e_s, e_i, e_r, n_s, n_i, n_r, n_ar, n_ui, custom_title, file_name)
+        if profiler is not None:
+            profiler.lap('draw')
 
     count_s = n_s[-1]
     count_i = n_i[-1] + n_ui[-1]
@@ -229,3 +448,134 @@ def run_model(
         print(info_dict_end)
 
     return info_dict_end, info_dict_shares, info_dict_status
+
+
+def run_replicates(
+        n_reps,
+        pop_size,
+        n_ticks,
+        n_friends,
+        n_add,
+        prob_share_indifferent,
+        prob_share_disinfo,
+        prob_share_facts,
+
+        attack_start,
+        attack_kind,
+        dark_quantile,
+
+        prob_prebunk,
+        prob_immune,
+
+        verbose=False,
+        return_tensors=False,
+        rng=rand,
+        graph_bank=None,
+        history=None,
+        fast_forward=False,
+        graph_start=0,
+        stats=None,
+        profiler=None,
+        common_seed=None,
+        n_light=1,
+        n_dark=1
+):
+    """
+    Simulate n_reps independent user networks with the same properties in lockstep. Every replicate gets its own
+    friend graph, the replicates are then stepped together as one (replicates x agents) array state by the numpy
+    engine.
+    n_reps: (int)
+        number of replicates
+    return_tensors: (bool)
+        should the results of every single replicate be returned as well?
+    rng: (random.Random)
+        [random]: source of all random draws of the replicates
+    graph_bank: (graphBank.GraphBank)
+        [None]: replicate r runs on graph graph_start + r of the bank instead of a newly generated graph
+    graph_start: (int)
+        [0]: first graph of the bank that is used (e.g. for replicates that are run in batches)
+    history: (opinionHistory.OpinionHistory)
+        [None]: recording policy for the opinions, agent a of replicate r is recorded as agent r * pop_size + a
+    fast_forward: (bool)
+        [False]: stop stepping once no status can change anymore in any replicate (see run_model)
+    stats: (onlineStats.ReplicateStats)
+        [None]: running statistics the results of every replicate are folded into (e.g. for the standard deviations
+        over replicates run in several batches)
+    profiler: (phaseProfiler.PhaseProfiler)
+        [None]: records the wall time and counters of every phase, summed over all replicates
+    common_seed: (int)
+        [None]: draw the share, prebunk and immunize decisions from the common random numbers of this seed, replicate
+        r uses stream graph_start + r (see commonRandom.CommonRandom), so replicates on the same graph face the same
+        draws in every cell
+    All other parameters are the same as for run_model.
+
+    Returns the same three dicts as run_model, holding the means over all replicates per tick, and if return_tensors
+    is set a fourth dict with the end, shares and status results of every replicate as arrays (n_reps, [n_ticks]).
+    """
+    if profiler is not None:
+        profiler.start()
+    if verbose:
+        print('create populations')
+    if graph_bank is not None:
+        if (graph_bank.pop_size, graph_bank.n_friends, graph_bank.n_add, graph_bank.dark_quantile, graph_bank.n_light,
+                graph_bank.n_dark) != (pop_size, n_friends, n_add, dark_quantile, n_light, n_dark):
+            raise ValueError("The graph bank was generated for different topology parameters.")
+        if graph_start + n_reps > len(graph_bank):
+            raise ValueError(f"The graph bank holds {len(graph_bank)} graphs, "
+                             f"graphs {graph_start} to {graph_start + n_reps - 1} were requested.")
+        graphs = [graph_bank.graph(graph_start + r) for r in range(n_reps)]
+    else:
+        graphs = [friend_graph(pop_size, n_friends, n_add, dark_quantile, rng, n_light, n_dark) for _ in range(n_reps)]
+        graphs = [(indptr, indices, light, dark) for indptr, indices, in_degree, light, dark in graphs]
+    pop = arrayModel.ArrayPopulation.from_graphs(graphs, prob_share_indifferent, prob_prebunk, prob_immune)
+    if profiler is not None:
+        profiler.lap('create_population', agents=n_reps * pop_size)
+
+    if verbose:
+        print('run model')
+    common = None
+    if common_seed is not None:
+        common = CommonRandom(common_seed, pop_size, range(graph_start, graph_start + n_reps))
+    shares, status = arrayModel.simulate(pop, n_ticks,
+                                         prob_share_indifferent, prob_share_disinfo, prob_share_facts,
+                                         attack_start, attack_kind,
+                                         np.random.default_rng(rng.getrandbits(64)),
+                                         history, fast_forward, profiler, common)
+
+    tensors_end = dict(
+        n_s=status[:, -1, arrayModel.S],
+        n_i=status[:, -1, arrayModel.I] + status[:, -1, arrayModel.UI],
+        n_r=status[:, -1, arrayModel.R] + status[:, -1, arrayModel.AR]
+    )
+    tensors_shares = dict(
+        s=shares[:, :, 0],
+        i=shares[:, :, 1],
+        r=shares[:, :, 2]
+    )
+    tensors_status = dict(
+        s=status[:, :, arrayModel.S],
+        i=status[:, :, arrayModel.I],
+        r=status[:, :, arrayModel.R],
+        ar=status[:, :, arrayModel.AR],
+        ui=status[:, :, arrayModel.UI]
+    )
+
+    if stats is not None:
+        stats.add(dict(end=tensors_end, shares=tensors_shares, status=tensors_status))
+
+    info_dict_end = {key: np.mean(value, axis=0) for key, value in tensors_end.items()}
+    info_dict_shares = {key: np.mean(value, axis=0) for key, value in tensors_shares.items()}
+    info_dict_status = {key: np.mean(value, axis=0) for key, value in tensors_status.items()}
+    if profiler is not None:
+        profiler.lap('aggregate')
+
+    if verbose:
+        print(info_dict_end)
+
+    if return_tensors:
+        return info_dict_end, info_dict_shares, info_dict_status, dict(
+            end=tensors_end,
+            shares=tensors_shares,
+            status=tensors_status
+        )
+    return info_dict_end, info_dict_shares, info_dict_status
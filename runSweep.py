@@ -0,0 +1,254 @@
+import functools
+import itertools
+import os
+import random as rand
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+from runModel import run_model, run_replicates
+from graphBank import load_bank
+from onlineStats import ReplicateStats
+from phaseProfiler import PhaseProfiler
+from commonRandom import common_seed
+
+# Probabilities of the five swept parameters and the order in which they are nested
+PROB_VALUES = [round(p, 1) for p in np.arange(0, 1.1, 0.1)]
+SWEEP_AXES = ('prob_prebunk', 'prob_immune', 'prob_share_indifferent', 'prob_share_disinfo', 'prob_share_facts')
+
+# Stopping rule of adaptive cells: full width of the confidence interval of the final infected and resistant counts
+ADAPTIVE_DEFAULTS = dict(target_width=2.0, confidence=.95, min_reps=20, batch_size=10)
+
+
+def cell_seed(cell, root_seed):
+    """
+    Seed of a sweep cell, derived only from the root seed and the cell's own parameter tuple (SeedSequence spawn key),
+    so the results of a cell do not depend on which cells ran before it or on which worker runs it
+    """
+    spawn_key = [cell['attack_kind'], cell['attack_start']] + [int(round(cell[axis] * 1000)) for axis in SWEEP_AXES]
+    return int(np.random.SeedSequence(root_seed, spawn_key=spawn_key).generate_state(1, np.uint64)[0])
+
+
+def sweep_cell(probs, attack_kind, attack_start, root_seed, n_reps=100, pop_size=100, n_ticks=100, n_friends=5,
+               n_add=5, dark_quantile=.75, graph_bank=None, fast_forward=True, adaptive=None,
+               quantiles=(), common_random=False, n_light=1, n_dark=1):
+    """
+    One sweep cell: a dict of the run_replicates parameters plus its seed
+    probs: (dict)
+        value of every parameter in SWEEP_AXES
+    graph_bank: (str)
+        [None]: path of a GraphBank all cells run their replicates on, by default every replicate gets a new graph
+    fast_forward: (bool)
+        [True]: fast-forward the replicates of a cell once they are absorbing (see run_model)
+    adaptive: (dict)
+        [None]: run the replicates of every cell in batches until the confidence intervals of the final infected and
+        resistant counts are narrow enough, n_reps is then the maximum number of replicates (see run_adaptive)
+    quantiles: (tuple)
+        [()]: quantiles over the replicates reported for every metric in addition to the standard deviation, e.g.
+        (0.05, 0.95)
+    common_random: (bool)
+        [False]: all cells draw the share, prebunk and immunize decisions of their replicates from the same common
+        random numbers (see commonRandom.CommonRandom), differences between cells then reflect the parameter changes
+        rather than sampling noise, most effective together with a graph bank
+    n_light, n_dark: (int)
+        [1]: number of light and dark agents of every network (see run_model), a graph bank has to be generated with
+        the same numbers
+    """
+    cell = dict(
+        n_reps=n_reps,
+        pop_size=pop_size,
+        n_ticks=n_ticks,
+        n_friends=n_friends,
+        n_add=n_add,
+        attack_start=attack_start,
+        attack_kind=attack_kind,
+        dark_quantile=dark_quantile,
+        n_light=n_light,
+        n_dark=n_dark,
+        fast_forward=fast_forward,
+        **{axis: probs[axis] for axis in SWEEP_AXES}
+    )
+    if graph_bank is not None:
+        cell['graph_bank'] = graph_bank
+    if adaptive is not None:
+        cell['adaptive'] = dict(ADAPTIVE_DEFAULTS, **adaptive)
+    if quantiles:
+        cell['quantiles'] = tuple(quantiles)
+    if common_random:
+        cell['common_seed'] = common_seed(root_seed)
+    cell['seed'] = cell_seed(cell, root_seed)
+    return cell
+
+
+def sweep_attrs(cell):
+    """
+    Fixed parameters of the sweep a cell belongs to: all its parameters except the swept probabilities and its seed,
+    stored as attrs of the result store, so that a store is only continued by the same sweep
+    """
+    return {key: value for key, value in cell.items() if key not in SWEEP_AXES and key != 'seed'}
+
+
+def sweep_cells(attack_kind, attack_start, root_seed, values=PROB_VALUES, **kwargs):
+    """
+    List of all cells of the full grid over values in the nesting order of SWEEP_AXES, kwargs are passed on to
+    sweep_cell
+    """
+    return [sweep_cell(dict(zip(SWEEP_AXES, probs)), attack_kind, attack_start, root_seed, **kwargs)
+            for probs in itertools.product(values, repeat=len(SWEEP_AXES))]
+
+
+def run_cell(cell, profiler=None):
+    """
+    Run all replicates of one sweep cell with its own random stream
+    profiler: (phaseProfiler.PhaseProfiler)
+        [None]: records the phases of all replicates of the cell
+    returns the three result dicts of run_replicates and the dispersion over the replicates (see
+    ReplicateStats.dispersion)
+    """
+    params = {key: value for key, value in cell.items() if key not in ('seed', 'graph_bank', 'adaptive', 'quantiles')}
+    graph_bank = load_bank(cell['graph_bank']) if 'graph_bank' in cell else None
+    stats = ReplicateStats(cell['pop_size'], cell['n_ticks'], cell.get('quantiles', ()), cell.get('n_dark', 1))
+    if 'adaptive' in cell:
+        result = run_adaptive(dict(params, profiler=profiler), rand.Random(cell['seed']), graph_bank, stats,
+                              **cell['adaptive'])
+    else:
+        result = run_replicates(**params, rng=rand.Random(cell['seed']), graph_bank=graph_bank, stats=stats,
+                                profiler=profiler)
+    return (*result, stats.dispersion())
+
+
+def run_adaptive(params, rng, graph_bank, stats, target_width, confidence, min_reps, batch_size):
+    """
+    Run the replicates of a cell in batches of batch_size until the confidence intervals of the final infected and
+    resistant counts are at most target_width wide (at least min_reps, at most params['n_reps'] replicates), the
+    batches are folded into stats (onlineStats.ReplicateStats) as they finish
+    returns the results of run_replicates over all replicates run, the end result additionally holds the number of
+    replicates (n_reps) and the achieved widths (ci_width_i, ci_width_r)
+    """
+    max_reps = params.pop('n_reps')
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    n = 0
+
+    while n < max_reps:
+        batch = min(batch_size, max_reps - n)
+        run_replicates(n_reps=batch, **params, rng=rng, graph_bank=graph_bank, graph_start=n, stats=stats)
+        n += batch
+
+        widths = [2 * z * stats.std(metric) / np.sqrt(n) if n > 1 else np.inf for metric in ('i', 'r')]
+        if n >= min_reps and max(widths) <= target_width:
+            break
+
+    info_dict_end, info_dict_shares, info_dict_status = stats.means()
+    info_dict_end.update(n_reps=n, ci_width_i=widths[0], ci_width_r=widths[1])
+
+    return info_dict_end, info_dict_shares, info_dict_status
+
+
+def run_cached_cell(cache, cell, profiler=None):
+    """
+    Run a sweep cell and store its result in the cache right away, so finished cells survive an interrupted sweep
+    """
+    result = run_cell(cell, profiler)
+    cache.put(cell, result)
+    return result
+
+
+def run_profiled_cell(worker, cell):
+    """
+    Run a sweep cell with worker (run_cell or run_cached_cell) under a new profiler
+    returns the result and the profiler
+    """
+    profiler = PhaseProfiler()
+    return worker(cell, profiler=profiler), profiler
+
+
+def available_workers():
+    """
+    Number of cores available to this process
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_sweep(cells, n_workers=None, chunksize=8, cache=None, profiler=None):
+    """
+    Run the cells on a process pool and yield (cell, result) pairs in the order of cells
+    n_workers: (int)
+        [None]: number of worker processes, all available cores by default, 1 runs in this process
+    chunksize: (int)
+        [8]: number of cells sent to a worker at once
+    cache: (resultCache.ResultCache)
+        [None]: cells found in the cache are not computed again, computed cells are added to it
+    profiler: (phaseProfiler.PhaseProfiler)
+        [None]: the phases of all computed cells are merged into it (cached cells are not profiled)
+    """
+    if n_workers is None:
+        n_workers = available_workers()
+
+    cached = [cache is not None and cell in cache for cell in cells]
+    missing = [cell for cell, is_cached in zip(cells, cached) if not is_cached]
+    worker = functools.partial(run_cached_cell, cache) if cache is not None else run_cell
+    if profiler is not None:
+        worker = functools.partial(run_profiled_cell, worker)
+
+    if n_workers == 1 or not missing:
+        yield from merge_results(cells, cached, map(worker, missing), cache, profiler)
+        return
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        yield from merge_results(cells, cached, executor.map(worker, missing, chunksize=chunksize), cache, profiler)
+
+
+def draw_cell(cell, directory):
+    """
+    Run the first replicate of a sweep cell with the object engine and draw its figure into directory
+    returns the file name of the figure
+    """
+    params = {key: value for key, value in cell.items()
+              if key not in ('n_reps', 'seed', 'graph_bank', 'adaptive', 'quantiles')}
+    graph = load_bank(cell['graph_bank']).graph(0) if 'graph_bank' in cell else None
+    probs = '_'.join(str(cell[axis]).replace('.', '_') for axis in SWEEP_AXES)
+    file_name = os.path.join(directory, f"cell_atk{cell['attack_kind']}_{probs}.png")
+    title = ', '.join(f'{axis}={cell[axis]}' for axis in SWEEP_AXES)
+    run_model(**params, draw=True, custom_title=f"attack kind {cell['attack_kind']}: {title}", file_name=file_name,
+              rng=rand.Random(cell['seed']), graph=graph)
+    return file_name
+
+
+def use_agg_backend():
+    """
+    Initializer of the drawing workers: render without a display
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def draw_cells(cells, directory='figures', n_workers=None):
+    """
+    Draw the figures of many sweep cells concurrently, one worker process per core by default (cells on the same
+    graph bank share the layout of its first graph, every worker computes it once)
+    returns the file names of the figures
+    """
+    os.makedirs(directory, exist_ok=True)
+    worker = functools.partial(draw_cell, directory=directory)
+    if n_workers == 1:
+        return list(map(worker, cells))
+    with ProcessPoolExecutor(n_workers, initializer=use_agg_backend) as executor:
+        return list(executor.map(worker, cells))
+
+
+def merge_results(cells, cached, computed, cache, profiler=None):
+    """
+    Yield (cell, result) in the order of cells, loading the result from the cache where it is cached, with a profiler
+    the computed results come with the profiler of their cell, which is merged into it
+    """
+    for cell, is_cached in zip(cells, cached):
+        if is_cached:
+            yield cell, cache.get(cell)
+        elif profiler is not None:
+            result, cell_profiler = next(computed)
+            profiler.merge(cell_profiler)
+            yield cell, result
+        else:
+            yield cell, next(computed)
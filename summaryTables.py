@@ -0,0 +1,125 @@
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+from runSweep import SWEEP_AXES
+from resultStore import ResultStore
+
+# Attack kind of the end result table that is also written as filtered_df.csv (the slider charts of plots.ipynb)
+FILTERED_ATTACK_KIND = 1
+# Share probabilities (prob_share_indifferent, prob_share_disinfo, prob_share_facts) of the infected proportion views
+VIEW_SHARES = ((.5, .5, .5),)
+
+COLUMNS = list(SWEEP_AXES) + ['s', 'i', 'r', 'mean_infected_prop']
+
+
+def write_csv(frame, file_name):
+    """
+    Write a frame atomically: readers see either the old or the new file, never a partly written one
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+    with os.fdopen(fd, 'w', newline='') as file:
+        frame.to_csv(file, index=False)
+    os.replace(tmp_name, file_name)
+
+
+class SummaryTables:
+    """
+    Summary tables of the sweeps, maintained while the cells complete:
+    all_results_atk<k>.csv     final s, i, r (and the infected proportion) of every finished cell of attack kind k
+    filtered_df.csv            the table of FILTERED_ATTACK_KIND
+    infected_views.csv         the rows of all attack kinds at the share probabilities of VIEW_SHARES
+
+    The rows are kept in memory (tables that exist already are read once on start, so an interrupted sweep continues
+    them), update adds the row of one cell and write replaces the files atomically.
+    """
+
+    def __init__(self, directory='.', load=True):
+        """
+        directory: (str)
+            ['.']: directory of the tables
+        load: (bool)
+            [True]: continue the tables that exist in directory
+        """
+        self.directory = directory
+        self.rows = {}  # attack kind -> {swept parameter values: row}
+        self._changed = set()
+        if not load:
+            return
+        for name in os.listdir(directory):
+            if name.startswith('all_results_atk') and name.endswith('.csv'):
+                attack_kind = int(name[len('all_results_atk'):-len('.csv')])
+                frame = pd.read_csv(os.path.join(directory, name))
+                self.rows[attack_kind] = {tuple(row[:len(SWEEP_AXES)]): list(row)
+                                          for row in frame[COLUMNS].itertuples(index=False)}
+
+    def update(self, cell, end_result):
+        """
+        Add (or replace) the row of a finished cell, end_result is the end result dict of run_replicates
+        """
+        probs = tuple(cell[axis] for axis in SWEEP_AXES)
+        row = list(probs) + [end_result['n_s'], end_result['n_i'], end_result['n_r'],
+                             end_result['n_i'] / cell['pop_size']]
+        self.rows.setdefault(cell['attack_kind'], {})[probs] = row
+        self._changed.add(cell['attack_kind'])
+
+    def table(self, attack_kind):
+        """
+        End result table of one attack kind, sorted in the nesting order of the sweep
+        """
+        return pd.DataFrame(sorted(self.rows.get(attack_kind, {}).values()), columns=COLUMNS)
+
+    def view(self, shares):
+        """
+        Rows of all attack kinds at the given (prob_share_indifferent, prob_share_disinfo, prob_share_facts)
+        """
+        frames = []
+        for attack_kind in sorted(self.rows):
+            frame = self.table(attack_kind)
+            frame = frame[(frame['prob_share_indifferent'] == shares[0]) & (frame['prob_share_disinfo'] == shares[1])
+                          & (frame['prob_share_facts'] == shares[2])]
+            frames.append(frame.assign(attack_kind=attack_kind))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS + ['attack_kind'])
+
+    def write(self):
+        """
+        Write the tables of all attack kinds with new rows and the views
+        """
+        for attack_kind in sorted(self._changed):
+            table = self.table(attack_kind)
+            write_csv(table, os.path.join(self.directory, f'all_results_atk{attack_kind}.csv'))
+            if attack_kind == FILTERED_ATTACK_KIND:
+                write_csv(table, os.path.join(self.directory, 'filtered_df.csv'))
+        if self._changed:
+            write_csv(pd.concat([self.view(shares) for shares in VIEW_SHARES], ignore_index=True),
+                      os.path.join(self.directory, 'infected_views.csv'))
+        self._changed.clear()
+
+    @classmethod
+    def rebuild(cls, results_path='results', directory='.'):
+        """
+        Build the tables from scratch from the result stores of all attack kinds (results_path/atk<k>)
+        """
+        tables = cls(directory, load=False)
+        for name in sorted(os.listdir(results_path)):
+            if not (name.startswith('atk') and os.path.exists(os.path.join(results_path, name, 'meta.json'))):
+                continue
+            store = ResultStore(os.path.join(results_path, name))
+            attack_kind = store.attrs['attack_kind']
+            pop_size = store.attrs['pop_size']
+            for idx, params in store.cells():
+                end_result = dict(n_s=store.data['s'][idx], n_i=store.data['i'][idx], n_r=store.data['r'][idx])
+                tables.update(dict(params, attack_kind=attack_kind, pop_size=pop_size), end_result)
+        tables.write()
+        return tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the summary tables of the sweeps from the result stores.')
+    parser.add_argument('--results', default='results', help='directory of the result stores (atk0, atk1, ...)')
+    parser.add_argument('--output', default='.', help='directory the tables are written to')
+    args = parser.parse_args()
+
+    tables = SummaryTables.rebuild(args.results, args.output)
+    print('Rebuilt the tables of attack kinds', sorted(tables.rows), 'in', args.output)
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import random as rand
+import socket
+import tempfile
+import threading
+import time
+
+from runSweep import sweep_cells, sweep_attrs, run_cell, SWEEP_AXES
+from resultCache import ResultCache, cell_key
+from resultStore import ResultStore, cell_metrics, store_metrics
+from graphBank import GraphBank, bank_path
+
+
+class WorkQueue:
+    """
+    Work queue of sweep cells on a (shared) directory, for workers on any number of hosts:
+    tasks/<key>.json     every submitted cell, key is its cell_key
+    pending/<key>        cells waiting for a worker
+    claimed/<key>        cells a worker is running, the file holds the worker id, its modification time is the lease
+    results/             ResultCache of the finished cells
+
+    A worker claims a cell by renaming its pending file to claimed, the rename is atomic, so exactly one worker gets
+    it. While running the cell the worker renews the lease by touching the claimed file. Claims whose lease ran out
+    (crashed or killed workers) are moved back to pending by the next worker that looks for work. A cell that is run
+    twice this way (a worker was only slow) gives the same result, it is written atomically either time.
+    The queue directory has to be mounted at the same path on every host and the clocks of the hosts are assumed to
+    agree within a small part of the lease.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = ResultCache(os.path.join(path, 'results'))
+        for directory in ('tasks', 'pending', 'claimed'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    def _file(self, directory, key):
+        return os.path.join(self.path, directory, key)
+
+    def submit(self, cells):
+        """
+        Add cells to the queue, cells that are pending, claimed or finished already are skipped (a cell whose task
+        was written without its pending file, e.g. by an interrupted submit, is queued again)
+        returns the number of added cells
+        """
+        added = 0
+        for cell in cells:
+            key = cell_key(cell)
+            task_file = self._file('tasks', key + '.json')
+            if not os.path.exists(task_file):
+                fd, tmp_name = tempfile.mkstemp(dir=os.path.join(self.path, 'tasks'), suffix='.tmp')
+                with os.fdopen(fd, 'w') as file:
+                    json.dump(cell, file)
+                os.replace(tmp_name, task_file)
+            if cell in self.results or os.path.exists(self._file('claimed', key)):
+                continue
+            try:
+                # Exclusive create, of two coordinators submitting the same cell only one queues it
+                open(self._file('pending', key), 'x').close()
+            except FileExistsError:
+                continue
+            added += 1
+        return added
+
+    def task(self, key):
+        with open(self._file('tasks', key + '.json')) as file:
+            return json.load(file)
+
+    def tasks(self):
+        """
+        All submitted cells
+        """
+        for name in sorted(os.listdir(os.path.join(self.path, 'tasks'))):
+            if name.endswith('.json'):
+                yield self.task(name[:-len('.json')])
+
+    def claim(self, worker_id, rng=rand):
+        """
+        Claim a pending cell for worker_id
+        returns (key, cell) or None if no cell is pending
+        """
+        pending = os.listdir(os.path.join(self.path, 'pending'))
+        rng.shuffle(pending)  # workers starting together try different cells first
+        for key in pending:
+            try:
+                # Start the lease before the claim, the claimed file keeps the modification time of the pending file
+                os.utime(self._file('pending', key))
+                os.rename(self._file('pending', key), self._file('claimed', key))
+            except FileNotFoundError:
+                continue  # claimed by another worker in the meantime
+            with open(self._file('claimed', key), 'w') as file:
+                file.write(worker_id)
+            return key, self.task(key)
+        return None
+
+    def renew(self, key):
+        """
+        Renew the lease of a claimed cell
+        """
+        try:
+            os.utime(self._file('claimed', key))
+        except FileNotFoundError:
+            pass  # the lease ran out and the cell was reclaimed, the result is still written on completion
+
+    def complete(self, key, cell, result, worker_id):
+        """
+        Store the result of a cell claimed by worker_id and release the claim
+        """
+        self.results.put(cell, result)
+        self.release(key, worker_id)
+
+    def release(self, key, worker_id):
+        """
+        Release the claim of worker_id on a cell, a claim that ran out and is held by another worker now is kept
+        """
+        try:
+            with open(self._file('claimed', key)) as file:
+                if file.read() != worker_id:
+                    return
+            os.remove(self._file('claimed', key))
+        except FileNotFoundError:
+            pass
+
+    def reclaim(self, lease):
+        """
+        Move claims whose lease ran out more than lease seconds ago back to pending
+        returns the number of reclaimed cells
+        """
+        reclaimed = 0
+        now = time.time()
+        for key in os.listdir(os.path.join(self.path, 'claimed')):
+            try:
+                expired = now - os.path.getmtime(self._file('claimed', key)) > lease
+                if expired:
+                    os.rename(self._file('claimed', key), self._file('pending', key))
+                    reclaimed += 1
+            except FileNotFoundError:
+                continue  # completed or reclaimed by another worker in the meantime
+        return reclaimed
+
+    def status(self):
+        """
+        Number of submitted, pending, claimed and finished cells
+        """
+        submitted = [name[:-len('.json')] for name in os.listdir(os.path.join(self.path, 'tasks'))
+                     if name.endswith('.json')]
+        return dict(
+            submitted=len(submitted),
+            pending=len(os.listdir(os.path.join(self.path, 'pending'))),
+            claimed=len(os.listdir(os.path.join(self.path, 'claimed'))),
+            finished=sum(self.task(key) in self.results for key in submitted),
+        )
+
+
+def renew_lease(queue, key, interval, finished):
+    """
+    Renew the lease of a claimed cell every interval seconds until finished is set
+    """
+    while not finished.wait(interval):
+        queue.renew(key)
+
+
+def run_worker(path, lease=600., poll=5., worker_id=None):
+    """
+    Run cells from the queue until no cell is pending or claimed anymore
+    lease: (float)
+        [600]: seconds after the last renewal at which the claim of a worker counts as lost, the lease is renewed
+        every lease / 4 seconds while a cell runs
+    poll: (float)
+        [5]: seconds to wait for running cells of other workers (they might still be reclaimed)
+    returns the number of cells run by this worker
+    """
+    queue = WorkQueue(path)
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    n_cells = 0
+
+    while True:
+        queue.reclaim(lease)
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            if not os.listdir(os.path.join(path, 'claimed')):
+                return n_cells
+            time.sleep(poll)
+            continue
+
+        key, cell = claimed
+        if key != cell_key(cell):
+            raise RuntimeError(f"Cell {key} was submitted with a different code version than the one of this worker.")
+        if cell in queue.results:
+            queue.release(key, worker_id)  # finished by a worker whose lease had run out
+            continue
+
+        # Renew the lease in the background while the cell runs
+        finished = threading.Event()
+        renewer = threading.Thread(target=renew_lease, args=(queue, key, lease / 4, finished), daemon=True)
+        renewer.start()
+        try:
+            result = run_cell(cell)
+        finally:
+            finished.set()
+            renewer.join()
+        queue.complete(key, cell, result, worker_id)
+        n_cells += 1
+
+
+def merge(path, results_path='results'):
+    """
+    Write the results of all finished cells of the queue into one result store per attack kind
+    (results_path/atk<attack_kind>), the axes of a store are the values of the swept parameters of its cells
+    returns the number of cells that are not finished yet
+    """
+    queue = WorkQueue(path)
+    by_kind = {}
+    for cell in queue.tasks():
+        by_kind.setdefault(cell['attack_kind'], []).append(cell)
+
+    missing = 0
+    for attack_kind, cells in by_kind.items():
+        axes = {axis: sorted({cell[axis] for cell in cells}) for axis in SWEEP_AXES}
+        store = ResultStore.open_or_create(os.path.join(results_path, f'atk{attack_kind}'), axes, cells[0]['n_ticks'],
+                                           attrs=sweep_attrs(cells[0]),
+                                           **store_metrics('adaptive' in cells[0], cells[0].get('quantiles', ())))
+        for cell in cells:
+            result = queue.results.get(cell)
+            if result is None:
+                missing += 1
+                continue
+            store.write(cell, cell_metrics(*result))
+        store.flush()
+    return missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a sweep with workers on several hosts through a shared directory.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='write the cells of a sweep into the queue (coordinator)')
+    submit.add_argument('queue', help='shared queue directory')
+    submit.add_argument('--attack-kind', type=int, required=True)
+    submit.add_argument('--root-seed', type=int, default=311)
+    submit.add_argument('--attack-start', type=int, default=5)
+    submit.add_argument('--n-ticks', type=int, default=100)
+    submit.add_argument('--n-reps', type=int, default=100)
+    submit.add_argument('--no-graph-bank', action='store_true', help='every replicate gets a new graph')
+    submit.add_argument('--common-random', action='store_true', help='all cells share the random draws of their replicates')
+
+    worker = commands.add_parser('worker', help='run cells from the queue until it is empty')
+    worker.add_argument('queue')
+    worker.add_argument('--lease', type=float, default=600., help='seconds until a silent claim is reclaimed')
+    worker.add_argument('--poll', type=float, default=5.)
+
+    merge_command = commands.add_parser('merge', help='write the finished cells into the result stores')
+    merge_command.add_argument('queue')
+    merge_command.add_argument('--results', default='results', help='directory of the result stores')
+
+    status = commands.add_parser('status', help='show the progress of the queue')
+    status.add_argument('queue')
+
+    args = parser.parse_args()
+    if args.command == 'submit':
+        graph_bank = None
+        if not args.no_graph_bank:
+            # The bank lives in the queue directory, so every host can read it
+            graph_bank = bank_path(os.path.join(os.path.abspath(args.queue), 'graphs'), args.n_reps, 100, 5, 5, .75, args.root_seed)
+            GraphBank.load_or_generate(graph_bank, n_graphs=args.n_reps, pop_size=100, n_friends=5, n_add=5,
+                                       dark_quantile=.75, seed=args.root_seed)
+        cells = sweep_cells(attack_kind=args.attack_kind, attack_start=args.attack_start, root_seed=args.root_seed,
+                            n_reps=args.n_reps, n_ticks=args.n_ticks, graph_bank=graph_bank,
+                            common_random=args.common_random)
+        print('Submitted', WorkQueue(args.queue).submit(cells), 'of', len(cells), 'cells.')
+    elif args.command == 'worker':
+        print('Ran', run_worker(args.queue, args.lease, args.poll), 'cells.')
+    elif args.command == 'merge':
+        missing = merge(args.queue, args.results)
+        print('Merged.' if not missing else f'Merged, {missing} cells are not finished yet.')
+    else:
+        print(WorkQueue(args.queue).status())